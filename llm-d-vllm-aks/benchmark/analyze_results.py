@@ -1,15 +1,132 @@
-import json, sys, statistics as stats
+#!/usr/bin/env python3
+# analyze_results.py — summarizes kv_latency_demo.py result rows.
+# Rows are streamed line by line into mergeable quantile sketches, so memory stays
+# bounded by the number of groups, not the number of rows.
+#
+# Usage:
+#   python3 analyze_results.py results.jsonl
+#   python3 analyze_results.py run1.jsonl run2.jsonl --group-by target,model
+#   python3 analyze_results.py results.jsonl --save-sketch run1.sketch.json
+#   python3 analyze_results.py --sketch run1.sketch.json --sketch run2.sketch.json
+#   python3 analyze_results.py results_npz/        # columnar output of kv_latency_demo.py --npz
+#   python3 analyze_results.py results.jsonl --compare lb,gw
+#   python3 analyze_results.py results.jsonl --metrics metrics.jsonl
+#   python3 analyze_results.py sweep.jsonl --prefix-curve --plot curve.png
+#   python3 analyze_results.py results.jsonl       # after --workers: the file plus its manifest's shards
+
+import argparse, bisect, glob, json, math, os, re, sys
 from collections import defaultdict
 
-path = sys.argv[1] if len(sys.argv) > 1 else "results.jsonl"
+# ---------------- Quantile sketch ----------------
 
-rows = []
-with open(path, encoding="utf-8") as f:
-    for line in f:
-        try:
-            rows.append(json.loads(line))
-        except Exception:
-            pass
+class LatencySketch:
+    """
+    Log-bucketed quantile sketch (DDSketch-style).
+
+    Values are counted in buckets whose bounds grow by gamma = (1+alpha)/(1-alpha), so
+    any reported quantile is within relative error alpha of the true one. Negative
+    values (warm - cold deltas) get their own bucket store. Two sketches with the
+    same alpha merge by adding bucket counts.
+    """
+
+    MIN_VALUE = 1e-9  # anything smaller in magnitude is counted as zero
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.pos = defaultdict(int)
+        self.neg = defaultdict(int)
+        self.zero = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, v):
+        return math.ceil(math.log(v) / self.log_gamma)
+
+    def _value(self, k):
+        return 2.0 * self.gamma ** k / (self.gamma + 1)
+
+    def add(self, v, n=1):
+        if v > self.MIN_VALUE:
+            self.pos[self._key(v)] += n
+        elif v < -self.MIN_VALUE:
+            self.neg[self._key(-v)] += n
+        else:
+            self.zero += n
+        self.count += n
+        self.total += v * n
+        if v < self.min:
+            self.min = v
+        if v > self.max:
+            self.max = v
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError(f"cannot merge sketches with alpha {self.alpha} and {other.alpha}")
+        for k, c in other.pos.items():
+            self.pos[k] += c
+        for k, c in other.neg.items():
+            self.neg[k] += c
+        self.zero += other.zero
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def histogram(self):
+        """(order key, count) per non-empty bucket, in ascending value order."""
+        out = [((0, -k), c) for k, c in self.neg.items()]
+        if self.zero:
+            out.append(((1, 0), self.zero))
+        out += [((2, k), c) for k, c in self.pos.items()]
+        return sorted(out)
+
+    def quantile(self, q):
+        """Nearest-rank value at quantile q (0..1), the ceil(q * count)th smallest, or None when empty."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for k in sorted(self.neg, reverse=True):
+            seen += self.neg[k]
+            if seen >= rank:
+                return max(self.min, -self._value(k))
+        seen += self.zero
+        if seen >= rank:
+            return 0.0
+        for k in sorted(self.pos):
+            seen += self.pos[k]
+            if seen >= rank:
+                return min(self.max, self._value(k))
+        return self.max
+
+    def to_dict(self):
+        return {
+            "alpha": self.alpha, "count": self.count, "total": self.total,
+            "min": self.min if self.count else None, "max": self.max if self.count else None,
+            "zero": self.zero,
+            "pos": {str(k): c for k, c in self.pos.items()},
+            "neg": {str(k): c for k, c in self.neg.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        s = cls(d["alpha"])
+        s.count, s.total, s.zero = d["count"], d["total"], d["zero"]
+        s.min = d["min"] if d["min"] is not None else math.inf
+        s.max = d["max"] if d["max"] is not None else -math.inf
+        s.pos.update({int(k): c for k, c in d["pos"].items()})
+        s.neg.update({int(k): c for k, c in d["neg"].items()})
+        return s
+
+# ---------------- Row fields ----------------
 
 def get_delta(r):
     if "delta_full_ms" in r:
@@ -21,32 +138,1095 @@ def get_delta(r):
         return round(r["warm_full_ms"] - r["cold_full_ms"], 2)
     return None
 
-by_target = defaultdict(list)
-by_target_fftp = defaultdict(list)
-
-for r in rows:
-    t = r.get("target", "unknown")
-    d = get_delta(r)
-    if d is not None:
-        by_target[t].append(d)
+def get_ttft_delta(r):
+    if "delta_ttft_ms" in r:
+        return r["delta_ttft_ms"]
+    # legacy field names
     if "warm_fftp_ms" in r and "cold_fftp_ms" in r:
-        by_target_fftp[t].append(round(r["warm_fftp_ms"] - r["cold_fftp_ms"], 2))
+        return round(r["warm_fftp_ms"] - r["cold_fftp_ms"], 2)
+    return None
+
+def get_itl(r):
+    """All inter-token latencies (ms) of the calls of a row."""
+    out = []
+    for k in ("cold_itl_us", "warm_itl_us", "itl_us"):
+        out.extend(us / 1000.0 for us in r.get(k) or ())
+    return out
+
+def field(name):
+    return lambda r: r.get(name)
+
+# Cache attribution: every request of a row (cold/warm of a pair, or the one request of a
+# tree/trace row) with its prompt and cached token counts. A request is a hit when any of
+# its prompt tokens came from the prefix cache; rows without cached_tokens are unattributed.
+
+REQUEST_PREFIXES = (("cold_", "usage_cold"), ("warm_", "usage_warm"), ("", "usage"))
+
+def cache_requests(r):
+    """(prefix, cached_tokens, prompt_tokens) for each request of a row that reports cached_tokens."""
+    for prefix, usage in REQUEST_PREFIXES:
+        cached = r.get(prefix + "cached_tokens")
+        if cached is not None:
+            yield prefix, cached, (r.get(usage) or {}).get("prompt_tokens")
+
+def cache_split(metric, hit):
+    """Extractor for metric (e.g. "ttft_ms") of the row's requests that were hits (or misses)."""
+    def extract(r):
+        out = [r[p + metric] for p, cached, _ in cache_requests(r)
+               if (cached > 0) == hit and r.get(p + metric) is not None]
+        return out or None
+    return extract
+
+def hit_ratio(prefix):
+    """Share of the prompt tokens of one request that were served from cache (0..1)."""
+    def extract(r):
+        for p, cached, prompt in cache_requests(r):
+            if p == prefix and prompt:
+                return min(1.0, cached / prompt)
+        return None
+    return extract
+
+def same_pod(r):
+    """1 when the warm follow-up went to the pod that served the cold request, 0 when not."""
+    cold, warm = r.get("cold_pod"), r.get("warm_pod")
+    if not cold or not warm:
+        return None
+    return 1.0 if cold == warm else 0.0
+
+# Hedging (kv_latency_demo.py --hedge-after): each request of a row says whether a duplicate
+# was sent (hedged), whether the duplicate won (hedge_won) and how many tokens the cancelled
+# loser had streamed (wasted_tokens; missing without --stream). Probes (hedge_probe) are
+# never hedged, so their TTFT is the in-run baseline for the hedgeable requests' of the
+# same kind (cold, warm, or node for tree/trace rows). Tails are also compared against the
+# same target's hedge=off rows when the input has both.
+
+def hedge_stat(name, hedged_only=True):
+    """Extractor for a hedge stat of each request of a row (only hedged requests by default)."""
+    def extract(r):
+        out = [float(r[p + name]) for p, _ in REQUEST_PREFIXES
+               if r.get(p + name) is not None and (r.get(p + "hedged") or not hedged_only)]
+        return out or None
+    return extract
+
+def hedge_ttft(prefix, probe):
+    """Extractor for the TTFT of one request of a row if it was an unhedged probe (or hedgeable)."""
+    def extract(r):
+        if r.get(prefix + "hedge_probe") is None or bool(r[prefix + "hedge_probe"]) != probe:
+            return None
+        return r.get(prefix + "ttft_ms")
+    return extract
+
+# (key, section title, extractor). Extractors return a number, a list of numbers or None.
+METRICS = [
+    ("delta_full", "Full latency deltas (warm - cold)", get_delta),
+    ("delta_ttft", "TTFT deltas (warm - cold)", get_ttft_delta),
+    ("cold_ttft", "Cold TTFT (ms)", field("cold_ttft_ms")),
+    ("warm_ttft", "Warm TTFT (ms)", field("warm_ttft_ms")),
+    ("cold_full", "Cold full latency (ms)", field("cold_full_ms")),
+    ("warm_full", "Warm full latency (ms)", field("warm_full_ms")),
+    ("itl", "Inter-token latency (ms)", get_itl),
+    ("node_ttft", "Per-request TTFT, tree/trace rows (ms)", field("ttft_ms")),
+    ("node_full", "Per-request full latency, tree/trace rows (ms)", field("full_ms")),
+    ("sched_ttft", "Per-request TTFT from scheduled send time, tree/trace rows (ms)", field("sched_ttft_ms")),
+    ("cold_sched_ttft", "Cold TTFT from scheduled send time (ms)", field("cold_sched_ttft_ms")),
+    ("lateness", "Trace send lateness (ms)", field("lateness_ms")),
+    ("queue", "Open-loop wait for a --max-inflight slot (ms)", field("queue_ms")),
+    ("improve_ttft", "Warm vs cold TTFT improvement (%)", field("improve_ttft_pct")),
+    ("improve_full", "Warm vs cold full-latency improvement (%)", field("improve_full_pct")),
+    ("ttft_hit", "TTFT of prefix-cache hits (ms)", cache_split("ttft_ms", True)),
+    ("ttft_miss", "TTFT of prefix-cache misses (ms)", cache_split("ttft_ms", False)),
+    ("full_hit", "Full latency of prefix-cache hits (ms)", cache_split("full_ms", True)),
+    ("full_miss", "Full latency of prefix-cache misses (ms)", cache_split("full_ms", False)),
+    ("wasted_tokens", "Tokens streamed by cancelled hedges, per hedged request", hedge_stat("wasted_tokens")),
+    ("cold_probe_ttft", "Cold TTFT of unhedged probes (ms)", hedge_ttft("cold_", True)),
+    ("cold_hedgeable_ttft", "Cold TTFT of requests that could be hedged (ms)", hedge_ttft("cold_", False)),
+    ("warm_probe_ttft", "Warm TTFT of unhedged probes (ms)", hedge_ttft("warm_", True)),
+    ("warm_hedgeable_ttft", "Warm TTFT of requests that could be hedged (ms)", hedge_ttft("warm_", False)),
+    ("node_probe_ttft", "Per-request TTFT of unhedged probes, tree/trace rows (ms)", hedge_ttft("", True)),
+    ("node_hedgeable_ttft", "Per-request TTFT of requests that could be hedged, tree/trace rows (ms)",
+     hedge_ttft("", False)),
+]
+
+HEDGE_KINDS = ("cold", "warm", "node")  # the key prefixes of the probe/hedgeable TTFT metrics
+
+# Per-request fractions, reported as their mean (a rate) rather than as quantiles.
+RATES = [
+    ("cold_hit_ratio", "cold prompt tokens cached", hit_ratio("cold_")),
+    ("warm_hit_ratio", "warm prompt tokens cached", hit_ratio("warm_")),
+    ("node_hit_ratio", "tree/trace prompt tokens cached", hit_ratio("")),
+    ("same_pod", "warm follow-ups on the cold request's pod", same_pod),
+]
+
+HEDGE_RATES = [
+    ("hedged", "requests hedged", hedge_stat("hedged", hedged_only=False)),
+    ("hedge_won", "hedges won by the duplicate", hedge_stat("hedge_won")),
+]
+
+def failed(r):
+    """1 for the error row of a failed session (kv_latency_demo.py writes one), else 0."""
+    return 1.0 if r.get("error") else 0.0
+
+ERROR_RATES = [("failed", "rows that are failed sessions", failed)]
+
+QUANTILES = [(0.50, "p50"), (0.90, "p90"), (0.99, "p99"), (0.999, "p99.9")]
+
+# ---------------- Aggregation ----------------
+
+class Summary:
+    """Sketches per (group, metric); group is a tuple of the --group-by field values."""
+
+    def __init__(self, group_by=("target",), alpha=0.01, keys=None):
+        self.group_by = tuple(group_by)
+        self.alpha = alpha
+        self.groups = defaultdict(dict)
+        self.skipped = 0
+        self.extractors = [m for m in METRICS + RATES + HEDGE_RATES + ERROR_RATES if keys is None or m[0] in keys]
+
+    def sketch(self, group, metric):
+        s = self.groups[group].get(metric)
+        if s is None:
+            s = self.groups[group][metric] = LatencySketch(self.alpha)
+        return s
+
+    def add_row(self, r):
+        group = tuple(str(r.get(f, "unknown")) for f in self.group_by)
+        for key, _, extract in self.extractors:
+            v = extract(r)
+            if v is None:
+                continue
+            if isinstance(v, list):
+                if v:
+                    s = self.sketch(group, key)
+                    for x in v:
+                        s.add(x)
+            else:
+                self.sketch(group, key).add(v)
+
+    def add_jsonl(self, path, *others):
+        """Feeds every row of path to this summary and to each of others (anything with add_row)."""
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except Exception:
+                    self.skipped += 1
+                    continue
+                if isinstance(r, dict):
+                    self.add_row(r)
+                    for other in others:
+                        other.add_row(r)
+
+    def merge(self, other):
+        if other.group_by != self.group_by:
+            raise SystemExit(f"cannot merge sketches grouped by {other.group_by} into {self.group_by}")
+        for group, metrics in other.groups.items():
+            for key, s in metrics.items():
+                self.sketch(group, key).merge(s)
+        return self
+
+    def to_dict(self):
+        return {
+            "alpha": self.alpha,
+            "group_by": list(self.group_by),
+            "groups": [{"group": list(g), "metrics": {k: s.to_dict() for k, s in m.items()}}
+                       for g, m in self.groups.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        out = cls(d["group_by"], d["alpha"])
+        for entry in d["groups"]:
+            out.groups[tuple(entry["group"])] = {
+                k: LatencySketch.from_dict(s) for k, s in entry["metrics"].items()}
+        return out
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+# ---------------- Sharded JSONL ----------------
+# kv_latency_demo.py --workers leaves one shard per worker (<jsonl>.w<i>) and lists them
+# in <jsonl>.manifest.json. A --jsonl path (or the manifest itself) expands to the file,
+# if present, plus every shard in the manifest.
+
+def jsonl_files(paths):
+    out = []
+    for path in paths:
+        manifest = path if path.endswith(".manifest.json") else path + ".manifest.json"
+        if path != manifest and (os.path.exists(path) or not os.path.exists(manifest)):
+            out.append(path)
+        if os.path.exists(manifest):
+            with open(manifest, encoding="utf-8") as f:
+                shards = json.load(f)["shards"]
+            out.extend(os.path.join(os.path.dirname(manifest), s["path"]) for s in shards)
+    return out
+
+# ---------------- Columnar (NumPy) path ----------------
+# Reads the .npz chunks written by kv_latency_demo.py --npz and computes the same
+# report with vectorized NumPy: exact quantiles instead of sketches, no per-row Python.
+
+def npz_files(path):
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "chunk-*.npz")))
+    return [path]
+
+def is_columnar(path):
+    return os.path.isdir(path) or path.endswith(".npz")
+
+def load_columns(paths):
+    """Concatenates every column of every chunk under paths into one dict of arrays."""
+    import numpy as np
+    parts = defaultdict(list)
+    for path in paths:
+        for fn in npz_files(path):
+            with np.load(fn) as z:
+                for k in z.files:
+                    parts[k].append(z[k])
+    return {k: np.concatenate(v) for k, v in parts.items()}
+
+class ArrayStats:
+    """Exact stats over a NumPy array with the count/mean()/quantile() interface of LatencySketch."""
+
+    def __init__(self, values):
+        self.values = values
+        self.count = int(values.size)
+
+    def mean(self):
+        return float(self.values.mean()) if self.count else None
+
+    def quantile(self, q):
+        """Nearest-rank value at quantile q, like LatencySketch.quantile and kv_latency_demo's percentile()."""
+        import numpy as np
+        return float(np.quantile(self.values, q, method="inverted_cdf")) if self.count else None
+
+def label_column(arr):
+    """Group labels for a column; whole-number floats print like the JSONL ints they came from."""
+    import numpy as np
+    if arr.dtype.kind != "f":
+        return arr.astype(str)
+    nan = np.isnan(arr)
+    if np.all(nan | (arr == np.round(arr))):
+        return np.where(nan, "None", np.where(nan, 0, arr).astype(np.int64).astype(str))
+    return arr.astype(str)
+
+class ColumnarSummary:
+    def __init__(self, cols, group_by=("target",)):
+        import numpy as np
+        self.group_by = tuple(group_by)
+        self.groups = defaultdict(dict)
+        n = len(cols["target"]) if "target" in cols else 0
+        if not n:
+            return
+
+        # Group id per row from the unique combinations of the group-by columns
+        keys = []
+        for f in self.group_by:
+            if f not in cols:
+                raise SystemExit(f"--group-by field {f!r} is not a column in the npz data")
+            keys.append(label_column(cols[f]))
+        labels = np.array(["\x1f".join(t) for t in zip(*keys)]) if len(keys) > 1 else keys[0]
+        uniq, gid = np.unique(labels, return_inverse=True)
+
+        def col(name):
+            return cols.get(name, np.full(n, np.nan))
+
+        # get_delta / get_ttft_delta, vectorized: stored delta, else warm - cold
+        delta_full = col("delta_full_ms")
+        delta_full = np.where(np.isnan(delta_full), col("warm_full_ms") - col("cold_full_ms"), delta_full)
+        delta_ttft = col("delta_ttft_ms")
+        delta_ttft = np.where(np.isnan(delta_ttft), col("warm_ttft_ms") - col("cold_ttft_ms"), delta_ttft)
+        per_row = {
+            "delta_full": delta_full,
+            "delta_ttft": delta_ttft,
+            "cold_ttft": col("cold_ttft_ms"),
+            "warm_ttft": col("warm_ttft_ms"),
+            "cold_full": col("cold_full_ms"),
+            "warm_full": col("warm_full_ms"),
+            "node_ttft": col("ttft_ms"),
+            "node_full": col("full_ms"),
+            "sched_ttft": col("sched_ttft_ms"),
+            "cold_sched_ttft": col("cold_sched_ttft_ms"),
+            "lateness": col("lateness_ms"),
+            "queue": col("queue_ms"),
+            "improve_ttft": col("improve_ttft_pct"),
+            "improve_full": col("improve_full_pct"),
+        }
+
+        # cache_split / hit_ratio / same_pod: one array per request kind, NaN where not attributed
+        kinds = [(col(p + "cached_tokens"), col(p + "prompt_tokens")) for p, _ in REQUEST_PREFIXES]
+        for metric in ("ttft", "full"):
+            vals = [col(f"{p}{metric}_ms") for p, _ in REQUEST_PREFIXES]
+            with np.errstate(invalid="ignore"):
+                per_row[f"{metric}_hit"] = [np.where(c > 0, v, np.nan) for v, (c, _) in zip(vals, kinds)]
+                per_row[f"{metric}_miss"] = [np.where(c == 0, v, np.nan) for v, (c, _) in zip(vals, kinds)]
+        for key, (cached, prompt) in zip(("cold_hit_ratio", "warm_hit_ratio", "node_hit_ratio"), kinds):
+            with np.errstate(invalid="ignore", divide="ignore"):
+                per_row[key] = np.where(prompt > 0, np.minimum(1.0, cached / prompt), np.nan)
+        if "cold_pod" in cols and "warm_pod" in cols:
+            cold, warm = cols["cold_pod"].astype(str), cols["warm_pod"].astype(str)
+            per_row["same_pod"] = np.where((cold != "") & (warm != ""), (cold == warm).astype(np.float64), np.nan)
+
+        if "error" in cols:
+            per_row["failed"] = (cols["error"].astype(str) != "").astype(np.float64)
+
+        # hedge_stat: hedged over all requests, hedge_won / wasted_tokens over hedged ones
+        hedged = [col(p + "hedged") for p, _ in REQUEST_PREFIXES]
+        per_row["hedged"] = hedged
+        for key in ("hedge_won", "wasted_tokens"):
+            per_row[key] = [np.where(h == 1, col(p + key), np.nan) for h, (p, _) in zip(hedged, REQUEST_PREFIXES)]
+        for kind, (p, _) in zip(HEDGE_KINDS, REQUEST_PREFIXES):
+            probe = col(p + "hedge_probe")
+            per_row[f"{kind}_probe_ttft"] = np.where(probe == 1, col(p + "ttft_ms"), np.nan)
+            per_row[f"{kind}_hedgeable_ttft"] = np.where(probe == 0, col(p + "ttft_ms"), np.nan)
+
+        # Ragged ITL values: repeat each row's group id once per value
+        itl_vals, itl_gid = [], []
+        for name in ("cold_itl_us", "warm_itl_us", "itl_us"):
+            if name in cols and f"{name}_len" in cols:
+                itl_vals.append(cols[name] / 1000.0)
+                itl_gid.append(np.repeat(gid, cols[f"{name}_len"]))
+        itl_vals = np.concatenate(itl_vals) if itl_vals else np.empty(0)
+        itl_gid = np.concatenate(itl_gid) if itl_gid else np.empty(0, dtype=np.int64)
+
+        order = np.argsort(gid, kind="stable")
+        bounds = np.searchsorted(gid[order], np.arange(len(uniq) + 1))
+        itl_order = np.argsort(itl_gid, kind="stable")
+        itl_bounds = np.searchsorted(itl_gid[itl_order], np.arange(len(uniq) + 1))
+        for g, label in enumerate(uniq):
+            group = tuple(str(label).split("\x1f")) if len(keys) > 1 else (str(label),)
+            rows = order[bounds[g]:bounds[g + 1]]
+            for key, vals in per_row.items():
+                v = np.concatenate([a[rows] for a in vals]) if isinstance(vals, list) else vals[rows]
+                v = v[~np.isnan(v)]
+                if v.size:
+                    self.groups[group][key] = ArrayStats(v)
+            v = itl_vals[itl_order[itl_bounds[g]:itl_bounds[g + 1]]]
+            if v.size:
+                self.groups[group]["itl"] = ArrayStats(v)
 
-def summarize(name, arr):
-    if not arr:
+# ---------------- Paired A/B comparison ----------------
+# lb and gw rows are paired by (model, index) — the same prompt pair under both routing
+# modes — and compared on paired differences. Confidence intervals come from a
+# vectorized bootstrap: each chunk of resamples is a (resamples x pairs) count matrix
+# built with one bincount, and a single matrix product yields the resampled means of
+# every metric at once.
+
+COMPARE_METRICS = ["cold_ttft_ms", "warm_ttft_ms", "cold_full_ms", "warm_full_ms",
+                   "delta_ttft_ms", "delta_full_ms"]
+
+def compare_columns_jsonl(paths):
+    """Reads only the columns the comparison needs from JSONL files."""
+    import numpy as np
+    keys, targets, values = [], [], []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except Exception:
+                    continue
+                if not isinstance(r, dict) or r.get("index") is None:
+                    continue
+                keys.append(f"{r.get('model')}\x1f{r['index']}")
+                targets.append(str(r.get("target")))
+                row = dict(r, delta_full_ms=get_delta(r), delta_ttft_ms=get_ttft_delta(r))
+                values.append([np.nan if row.get(m) is None else float(row[m]) for m in COMPARE_METRICS])
+    return np.array(keys), np.array(targets), np.array(values, dtype=np.float64).reshape(-1, len(COMPARE_METRICS))
+
+def compare_columns_npz(cols):
+    import numpy as np
+    n = len(cols.get("target", ()))
+    keys = np.char.add(np.char.add(cols["model"].astype(str), "\x1f"),
+                       cols["index"].astype(np.int64).astype(str)) if n else np.empty(0, dtype=str)
+    values = np.stack([cols.get(m, np.full(n, np.nan)) for m in COMPARE_METRICS], axis=1)
+    # get_delta / get_ttft_delta fallbacks
+    for j, (warm, cold) in ((4, ("warm_ttft_ms", "cold_ttft_ms")), (5, ("warm_full_ms", "cold_full_ms"))):
+        if warm in cols and cold in cols:
+            values[:, j] = np.where(np.isnan(values[:, j]), cols[warm] - cols[cold], values[:, j])
+    return keys, cols["target"].astype(str), values
+
+def pair_rows(keys, targets, values, a, b):
+    """Averages repeated rows per key and target; returns (A, B) aligned on keys present in both."""
+    import numpy as np
+    ok = ~np.isnan(values).any(axis=1)
+
+    def per_key(target):
+        mask = ok & (targets == target)
+        uniq, inv = np.unique(keys[mask], return_inverse=True)
+        counts = np.bincount(inv, minlength=len(uniq))
+        sums = np.stack([np.bincount(inv, weights=values[mask, j], minlength=len(uniq))
+                         for j in range(values.shape[1])], axis=1)
+        return uniq, sums / counts[:, None]
+
+    ka, va = per_key(a)
+    kb, vb = per_key(b)
+    _, ia, ib = np.intersect1d(ka, kb, return_indices=True)
+    return va[ia], vb[ib]
+
+def bootstrap_means(X, resamples, rng, chunk_cells=10_000_000):
+    """Bootstrap distribution of the column means of X (n x k) -> (resamples x k)."""
+    import numpy as np
+    n = X.shape[0]
+    step = max(1, chunk_cells // n)
+    out = np.empty((resamples, X.shape[1]))
+    for start in range(0, resamples, step):
+        m = min(step, resamples - start)
+        idx = rng.integers(0, n, size=(m, n))
+        idx += np.arange(m)[:, None] * n
+        counts = np.bincount(idx.ravel(), minlength=m * n).reshape(m, n)
+        out[start:start + m] = counts @ X / n
+    return out
+
+def compare(A, B, resamples=10000, confidence=0.95, seed=0):
+    """Per-metric paired stats for B vs A (negative diff == B faster)."""
+    import numpy as np
+    D = B - A
+    k = A.shape[1]
+    boot = bootstrap_means(np.hstack([A, D]), resamples, np.random.default_rng(seed))
+    boot_a, boot_d = boot[:, :k], boot[:, k:]
+    lo_q, hi_q = (1 - confidence) / 2, 1 - (1 - confidence) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        boot_rel = boot_d / boot_a * 100.0
+        sd = D.std(axis=0, ddof=1) if len(D) > 1 else np.full(k, np.nan)
+        dz = D.mean(axis=0) / sd
+    out = {}
+    for j, name in enumerate(COMPARE_METRICS):
+        mean_a, mean_d = A[:, j].mean(), D[:, j].mean()
+        rel_ok = mean_a > 0 and not name.startswith("delta_")  # % of a delta is meaningless
+        out[name] = {
+            "mean_a": float(mean_a),
+            "mean_b": float(B[:, j].mean()),
+            "diff": float(mean_d),
+            "diff_ci": tuple(float(x) for x in np.quantile(boot_d[:, j], [lo_q, hi_q])),
+            "rel_pct": float(mean_d / mean_a * 100.0) if rel_ok else None,
+            "rel_ci": tuple(float(x) for x in np.quantile(boot_rel[:, j], [lo_q, hi_q])) if rel_ok else None,
+            "dz": float(dz[j]),
+            "p_b_faster": float((D[:, j] < 0).mean() + 0.5 * (D[:, j] == 0).mean()),
+        }
+    return out
+
+def print_compare(stats, a, b, n, resamples, confidence):
+    A, B = a.upper(), b.upper()
+    print(f"=== Paired comparison: {B} vs {A} (n={n} pairs by model+index, "
+          f"{resamples} resamples, {confidence * 100:g}% CI) ===")
+    if not n:
+        print(f"no prompt index has rows for both {a} and {b}")
+        return
+    for name, st in stats.items():
+        lo, hi = st["diff_ci"]
+        line = (f"{name}: {A}={st['mean_a']:.1f}  {B}={st['mean_b']:.1f}  "
+                f"Δ={st['diff']:+.1f} ms [{lo:+.1f}, {hi:+.1f}]")
+        if st["rel_pct"] is not None:
+            rlo, rhi = st["rel_ci"]
+            line += f"  Δ%={st['rel_pct']:+.1f}% [{rlo:+.1f}, {rhi:+.1f}]"
+        line += f"  dz={st['dz']:+.2f}  P({b}<{a})={st['p_b_faster']:.2f}"
+        print(line)
+
+# ---------------- Prefix-length curve ----------------
+# --prefix-curve reads cold/warm pairs of a make_prompts.py --prefix-sweep workload, whose
+# topic starts with "prefix=L" (L = shared prefix in tokens), and reports per target and L:
+# cold and warm TTFT, the TTFT the warm call saved (per-pair cold - warm and the relative
+# improvement), and prefill throughput: cold prompt tokens over cold TTFT, and warm prompt
+# tokens over warm TTFT as the effective rate with the cached prefix. Other rows are skipped.
+
+PREFIX_TOPIC = re.compile(r"^prefix=(\d+)\b")
+
+CURVE_METRICS = [
+    ("cold_ttft", lambda r: r.get("cold_ttft_ms")),
+    ("warm_ttft", lambda r: r.get("warm_ttft_ms")),
+    ("saved_ms", lambda r: -get_ttft_delta(r) if get_ttft_delta(r) is not None else None),
+    ("saved_pct", field("improve_ttft_pct")),
+    ("cold_tps", lambda r: prefill_tps(r, "cold")),
+    ("warm_tps", lambda r: prefill_tps(r, "warm")),
+]
+
+def prefill_tps(r, kind):
+    prompt = (r.get(f"usage_{kind}") or {}).get("prompt_tokens")
+    ttft = r.get(f"{kind}_ttft_ms")
+    return prompt / (ttft / 1000.0) if prompt and ttft else None
+
+def curve_rows(paths, columnar):
+    """Rows reduced to the fields the prefix curve needs, from JSONL or npz input."""
+    if not columnar:
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(r, dict):
+                        yield r
+        return
+    cols = load_columns(paths)
+    n = len(cols.get("target", ()))
+    fields = ["cold_ttft_ms", "warm_ttft_ms", "delta_ttft_ms", "improve_ttft_pct",
+              "cold_prompt_tokens", "warm_prompt_tokens"]
+    values = {f: cols[f].tolist() for f in fields if f in cols}
+    targets, topics = cols["target"].astype(str).tolist() if n else [], cols["topic"].astype(str).tolist() if n else []
+    for i in range(n):
+        r = {"target": targets[i], "topic": topics[i]}
+        r.update((f, v[i]) for f, v in values.items() if v[i] == v[i])  # drop NaN
+        for kind in ("cold", "warm"):
+            if f"{kind}_prompt_tokens" in r:
+                r[f"usage_{kind}"] = {"prompt_tokens": r.pop(f"{kind}_prompt_tokens")}
+        yield r
+
+def prefix_curve(rows, alpha=0.01):
+    """{(target, L): {metric: LatencySketch}} and the number of rows without a prefix= topic."""
+    curve = defaultdict(dict)
+    skipped = 0
+    for r in rows:
+        m = PREFIX_TOPIC.match(str(r.get("topic") or ""))
+        if not m or r.get("cold_ttft_ms") is None:
+            skipped += 1
+            continue
+        point = curve[(str(r.get("target")), int(m.group(1)))]
+        for key, extract in CURVE_METRICS:
+            v = extract(r)
+            if v is not None:
+                point.setdefault(key, LatencySketch(alpha)).add(v)
+    return curve, skipped
+
+def print_prefix_curve(curve):
+    def p50(point, key):
+        s = point.get(key)
+        return s.quantile(0.5) if s and s.count else None
+
+    for target in sorted({t for t, _ in curve}):
+        print(f"\n=== TTFT savings by shared-prefix length: {target.upper()} ===")
+        print(f"{'prefix':>8} {'n':>5} {'cold p50':>9} {'warm p50':>9} {'saved p50':>10} {'saved%':>7} "
+              f"{'cold tok/s':>11} {'warm tok/s':>11}")
+        for (t, length), point in sorted(curve.items()):
+            if t != target:
+                continue
+            pct = p50(point, "saved_pct")
+            bar = "#" * max(0, round((pct or 0) / 5))
+            print(f"{length:>8} {point['cold_ttft'].count:>5} {fmt(p50(point, 'cold_ttft'), '9.1f'):>9} "
+                  f"{fmt(p50(point, 'warm_ttft'), '9.1f'):>9} {fmt(p50(point, 'saved_ms'), '10.1f'):>10} "
+                  f"{fmt(pct, '6.1f', '%'):>7} {fmt(p50(point, 'cold_tps'), '11.0f'):>11} "
+                  f"{fmt(p50(point, 'warm_tps'), '11.0f'):>11}  {bar}")
+
+def plot_prefix_curve(curve, path):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise SystemExit("--plot needs matplotlib: pip install matplotlib")
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 4.5))
+    for target in sorted({t for t, _ in curve}):
+        points = sorted((length, p) for (t, length), p in curve.items() if t == target)
+        xs = [length for length, _ in points]
+        saved = [p["saved_ms"].quantile(0.5) if "saved_ms" in p else float("nan") for _, p in points]
+        ax1.plot(xs, saved, marker="o", label=target)
+        for key, style in (("cold_tps", "-"), ("warm_tps", "--")):
+            ax2.plot(xs, [p[key].quantile(0.5) if key in p else float("nan") for _, p in points],
+                     style, marker="o", label=f"{target} {key[:4]}")
+    ax1.set(xscale="log", xlabel="shared prefix (tokens)", ylabel="TTFT saved, p50 (ms)")
+    ax2.set(xscale="log", yscale="log", xlabel="shared prefix (tokens)", ylabel="prefill tokens/s, p50")
+    for ax in (ax1, ax2):
+        ax.grid(True, which="both", alpha=0.3)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    print(f"\n[plot] wrote {path}")
+
+# ---------------- Regression gate ----------------
+# --save-baseline stores a run's sketches (as --save-sketch does) and its throughput, as
+# completed requests per wall-clock second from each request's ts_start + full_ms.
+# --baseline checks the current run against that file, per group:
+#   latency (GATE_METRICS): p50 or p99 more than --max-regress-pct worse, and a one-sided
+#     Mann-Whitney U test on the two sketch histograms (values sharing a bucket are ties)
+#     says the new values are larger with p < --p-value
+#   throughput: mean requests/s more than --max-regress-pct lower, and a one-sided Welch
+#     test on the per-second counts (normal approximation) gives p < --p-value
+#   errors: the share of failed sessions is higher, and a one-sided two-proportion z-test
+#     gives p < --p-value
+# A baseline group that has no latency results in the current run (missing, empty, or
+# nothing but errors) fails too. Any failure exits with status 1, so the check can gate a
+# deployment pipeline.
+
+GATE_METRICS = ["cold_ttft", "warm_ttft", "node_ttft", "itl", "cold_full", "warm_full", "node_full"]
+
+class Throughput:
+    """Completed requests per whole wall-clock second, per group."""
+
+    def __init__(self, group_by=("target",)):
+        self.group_by = tuple(group_by)
+        self.seconds = defaultdict(lambda: defaultdict(int))
+        self.stored = {}
+
+    def add_row(self, r):
+        group = tuple(str(r.get(f, "unknown")) for f in self.group_by)
+        for _, _, end, _ in request_windows(r):
+            self.seconds[group][int(end)] += 1
+
+    def samples(self, group):
+        """Per-second counts without the partial first and last second."""
+        if group in self.stored:
+            return self.stored[group]
+        c = self.seconds.get(group)
+        if not c:
+            return []
+        return [c.get(sec, 0) for sec in range(min(c) + 1, max(c))]
+
+    def to_dict(self):
+        groups = set(self.seconds) | set(self.stored)
+        return {"group_by": list(self.group_by),
+                "groups": [{"group": list(g), "per_second": self.samples(g)} for g in sorted(groups)]}
+
+    @classmethod
+    def from_dict(cls, d):
+        out = cls(d["group_by"])
+        out.stored = {tuple(e["group"]): e["per_second"] for e in d["groups"]}
+        return out
+
+def mann_whitney_greater(new, base):
+    """One-sided p-value that sketch new holds larger values than sketch base (normal approximation)."""
+    n1, n2 = new.count, base.count
+    if not n1 or not n2:
+        return None
+    a, b = dict(new.histogram()), dict(base.histogram())
+    u, below, ties = 0.0, 0, 0
+    for key in sorted(set(a) | set(b)):
+        ca, cb = a.get(key, 0), b.get(key, 0)
+        u += ca * (below + 0.5 * cb)
+        below += cb
+        ties += (ca + cb) ** 3 - (ca + cb)
+    n = n1 + n2
+    var = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+    if var <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2.0) / math.sqrt(var)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def welch_lower(new, base):
+    """One-sided p-value that the mean of new is below the mean of base (normal approximation)."""
+    if len(new) < 2 or len(base) < 2:
+        return None
+    def mean_var(x):
+        m = sum(x) / len(x)
+        return m, sum((v - m) ** 2 for v in x) / (len(x) - 1)
+    (m1, v1), (m2, v2) = mean_var(new), mean_var(base)
+    se = math.sqrt(v1 / len(new) + v2 / len(base))
+    if se == 0:
+        return 0.0 if m1 < m2 else 1.0
+    return 0.5 * math.erfc(-(m1 - m2) / se / math.sqrt(2))
+
+def proportion_greater(x1, n1, x2, n2):
+    """One-sided p-value that rate x1/n1 is above rate x2/n2 (pooled two-proportion z-test)."""
+    if not n1 or not n2:
+        return None
+    pooled = (x1 + x2) / (n1 + n2)
+    se = math.sqrt(pooled * (1 - pooled) * (1 / n1 + 1 / n2))
+    if se == 0:
+        return 1.0  # both all ok or both all failed
+    z = (x1 / n1 - x2 / n2) / se
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def save_baseline(path, summary, throughput, sources):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "sources": sources, "summary": summary.to_dict(),
+                   "throughput": throughput.to_dict()}, f)
+    os.replace(path + ".tmp", path)
+
+def load_baseline(path):
+    with open(path, encoding="utf-8") as f:
+        d = json.load(f)
+    return Summary.from_dict(d["summary"]), Throughput.from_dict(d["throughput"])
+
+def pct_change(new, base):
+    return (new - base) / base * 100.0 if base else None
+
+def regression_gate(base, base_tp, cur, cur_tp, max_pct, p_max):
+    """Prints one line per compared metric and group; returns the number of regressions."""
+    if not base.groups:
+        print("baseline has no results  FAIL")
+        return 1
+    regressions = 0
+    for g in sorted(set(base.groups) | set(cur.groups)):
+        label = group_label(base.group_by, g)
+        if g not in base.groups:
+            print(f"{label}: only in current run, not compared")
+            continue
+        if not any(cur.groups.get(g, {}).get(key) and cur.groups[g][key].count for key in GATE_METRICS):
+            print(f"{label}: no results in the current run  MISSING")
+            regressions += 1
+            continue
+        for key in GATE_METRICS:
+            b, c = base.groups[g].get(key), cur.groups[g].get(key)
+            if not b or not c or not b.count or not c.count:
+                continue
+            changes = [pct_change(c.quantile(q), b.quantile(q)) for q in (0.5, 0.99)]
+            p = mann_whitney_greater(c, b)
+            bad = any(ch is not None and ch > max_pct for ch in changes) and p is not None and p < p_max
+            regressions += bad
+            print(f"{label} {key}: p50 {b.quantile(0.5):.1f} -> {c.quantile(0.5):.1f} ({fmt(changes[0], '+.1f', '%')})  "
+                  f"p99 {b.quantile(0.99):.1f} -> {c.quantile(0.99):.1f} ({fmt(changes[1], '+.1f', '%')})  "
+                  f"p={fmt(p, '.2g')}  {'REGRESSION' if bad else 'ok'}")
+        b, c = base.groups[g].get("failed"), cur.groups[g].get("failed")
+        if b and c and b.count and c.count:
+            xb, xc = round(b.total), round(c.total)
+            p = proportion_greater(xc, c.count, xb, b.count)
+            bad = xc / c.count > xb / b.count and p is not None and p < p_max
+            regressions += bad
+            print(f"{label} errors: {xb}/{b.count} ({xb / b.count * 100:.1f}%) -> {xc}/{c.count} "
+                  f"({xc / c.count * 100:.1f}%)  p={fmt(p, '.2g')}  {'REGRESSION' if bad else 'ok'}")
+        b, c = base_tp.samples(g), cur_tp.samples(g)
+        if b and c:
+            mb, mc = sum(b) / len(b), sum(c) / len(c)
+            change = pct_change(mc, mb)
+            p = welch_lower(c, b)
+            bad = change is not None and change < -max_pct and p is not None and p < p_max
+            regressions += bad
+            print(f"{label} req/s: {mb:.2f} -> {mc:.2f} ({fmt(change, '+.1f', '%')})  "
+                  f"p={fmt(p, '.2g')}  {'REGRESSION' if bad else 'ok'}")
+    return regressions
+
+# ---------------- Server metrics join ----------------
+# --metrics FILE reads the samples written by kv_latency_demo.py --metrics-url and looks
+# at the server side of each request's window [ts_start, ts_start + full_ms]:
+#   prefix_hit  prefix-cache hit tokens / queried tokens, from counter deltas between the
+#               last sample at or before the window and the first sample at or after it
+#               (so with concurrent traffic it is the cluster's rate around the request)
+#   kv_usage    highest KV-cache usage of any pod during the window
+#   waiting     highest total queue depth during the window
+# The timeline splits the run into --metrics-buckets slices to show when KV pressure
+# rises and the hit rate falls.
+
+HIT_NAMES = ("vllm:prefix_cache_hits_total", "vllm:gpu_prefix_cache_hits_total")
+QUERY_NAMES = ("vllm:prefix_cache_queries_total", "vllm:gpu_prefix_cache_queries_total")
+KV_NAMES = ("vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc")
+WAITING_NAMES = ("vllm:num_requests_waiting",)
+
+class ServerMetrics:
+    def __init__(self, path):
+        # series[pod][name] = (timestamps, values), both sorted by time
+        self.series = defaultdict(lambda: defaultdict(lambda: ([], [])))
+        pods, names = [], []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(rec, dict):
+                    pods, names = rec["pods"], rec["names"]
+                    continue
+                ts, pod = rec[0], pods[rec[1]]
+                for name, v in zip(names, rec[2:]):
+                    if v is not None:
+                        t, vals = self.series[pod][name]
+                        t.append(ts)
+                        vals.append(v)
+        ts = [t for by_name in self.series.values() for t, _ in by_name.values()]
+        if not any(ts):
+            raise SystemExit(f"No metric samples in {path}")
+        self.start = min(t[0] for t in ts if t)
+        self.end = max(t[-1] for t in ts if t)
+
+    def _get(self, pod, names):
+        for n in names:
+            if n in self.series[pod]:
+                return self.series[pod][n]
+        return None
+
+    def counter_delta(self, names, s, e):
+        total = 0.0
+        for pod in self.series:
+            found = self._get(pod, names)
+            if not found:
+                continue
+            t, vals = found
+            i = max(0, bisect.bisect_right(t, s) - 1)
+            j = min(len(t) - 1, bisect.bisect_left(t, e))
+            total += max(0.0, vals[j] - vals[i])  # negative means a counter reset
+        return total
+
+    def gauge_max(self, names, s, e, combine=max):
+        """Per pod: max sample in [s, e] (else the last one before s); combined across pods."""
+        per_pod = []
+        for pod in self.series:
+            found = self._get(pod, names)
+            if not found:
+                continue
+            t, vals = found
+            i = max(0, bisect.bisect_right(t, s) - 1)
+            j = bisect.bisect_right(t, e)
+            per_pod.append(max(vals[i:max(j, i + 1)]))
+        return combine(per_pod) if per_pod else None
+
+    def window(self, s, e):
+        queries = self.counter_delta(QUERY_NAMES, s, e)
+        return {
+            "prefix_hit": self.counter_delta(HIT_NAMES, s, e) / queries if queries else None,
+            "kv_usage": self.gauge_max(KV_NAMES, s, e),
+            "waiting": self.gauge_max(WAITING_NAMES, s, e, combine=sum),
+        }
+
+def request_windows(r):
+    """(kind, start, end, ttft_ms) for each request of a row: cold/warm for pairs, else one."""
+    for prefix, kind in (("cold_", "cold"), ("warm_", "warm"), ("", "request")):
+        start, full = r.get(prefix + "ts_start"), r.get(prefix + "full_ms")
+        if start is not None and full is not None and start == start and full == full:  # not NaN
+            yield kind, start, start + full / 1000.0, r.get(prefix + "ttft_ms")
+
+def metric_rows(paths, group_by, columnar):
+    """Rows reduced to the fields the metrics join needs, from JSONL or npz input."""
+    fields = ["ts_start", "full_ms", "ttft_ms"]
+    fields += [f"{p}_{f}" for p in ("cold", "warm") for f in fields]
+    if not columnar:
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(r, dict):
+                        yield r
+        return
+    cols = load_columns(paths)
+    n = len(next(iter(cols.values()))) if cols else 0
+    labels = {g: label_column(cols[g]) if g in cols else ["unknown"] * n for g in group_by}
+    values = {f: cols[f].tolist() for f in fields if f in cols}
+    for i in range(n):
+        r = {g: labels[g][i] for g in group_by}
+        r.update((f, v[i]) for f, v in values.items())
+        yield r
+
+def mean_of(vals):
+    vals = [v for v in vals if v is not None]
+    return sum(vals) / len(vals) if vals else None
+
+def fmt(v, spec, suffix=""):
+    return "-" if v is None else f"{v:{spec}}{suffix}"
+
+def print_metrics_report(sm, rows, group_by, buckets):
+    per_group = defaultdict(list)
+    starts = []
+    for r in rows:
+        group = tuple(str(r.get(f, "unknown")) for f in group_by)
+        for kind, s, e, ttft in request_windows(r):
+            w = sm.window(s, e)
+            per_group[group + (kind,)].append(w)
+            starts.append((s, ttft))
+
+    print(f"\n=== Server metrics during requests ({len(sm.series)} pods, "
+          f"{sm.end - sm.start:.0f}s of samples) ===")
+    for key in sorted(per_group):
+        ws = per_group[key]
+        hit = mean_of(w["prefix_hit"] for w in ws)
+        print(f"{group_label(group_by, key[:-1])} {key[-1]}: n={len(ws)}  "
+              f"prefix_hit={fmt(hit and hit * 100, '.1f', '%')}  "
+              f"kv_usage={fmt(mean_of(w['kv_usage'] for w in ws), '.2f')}  "
+              f"waiting={fmt(mean_of(w['waiting'] for w in ws), '.1f')}")
+
+    if buckets < 1 or sm.end <= sm.start:
+        return
+    print(f"\n=== Server metrics timeline ({buckets} slices) ===")
+    width = (sm.end - sm.start) / buckets
+    for b in range(buckets):
+        s = sm.start + b * width
+        e = s + width
+        w = sm.window(s, e)
+        ttfts = [t for st, t in starts if s <= st < e and t is not None]
+        print(f"+{s - sm.start:7.1f}s  prefix_hit={fmt(w['prefix_hit'] and w['prefix_hit'] * 100, '5.1f', '%')}  "
+              f"kv_usage={fmt(w['kv_usage'], '.2f')}  waiting={fmt(w['waiting'], '.0f')}  "
+              f"requests={len(ttfts)}  ttft_mean={fmt(mean_of(ttfts), '.1f')}")
+
+# ---------------- Report ----------------
+
+def group_label(group_by, group):
+    parts = []
+    for f, v in zip(group_by, group):
+        parts.append(v.upper() if f == "target" else f"{f}={v}")
+    return " ".join(parts)
+
+def summarize(name, s):
+    if s is None or not s.count:
         return f"{name}: n=0"
-    arr_sorted = sorted(arr)
-    p10 = arr_sorted[max(0, int(0.10 * (len(arr_sorted)-1)))]
-    p90 = arr_sorted[min(len(arr_sorted)-1, int(0.90 * (len(arr_sorted)-1)))]
-    return (f"{name}: n={len(arr)}  "
-            f"meanΔ={stats.mean(arr):.1f} ms  "
-            f"medianΔ={stats.median(arr):.1f} ms  "
-            f"p10={p10:.1f}  p90={p90:.1f}")
-
-print("=== Full latency deltas (warm - cold) ===")
-for tgt, arr in by_target.items():
-    print(summarize(tgt.upper(), arr))
-
-print("\n=== FFTP deltas (warm - cold) ===")
-for tgt, arr in by_target_fftp.items():
-    print(summarize(tgt.upper(), arr))
+    qs = "  ".join(f"{label}={s.quantile(q):.1f}" for q, label in QUANTILES)
+    return f"{name}: n={s.count}  mean={s.mean():.1f}  {qs}"
+
+def print_report(summary):
+    first = True
+    for key, title, _ in METRICS:
+        groups = [g for g in sorted(summary.groups) if key in summary.groups[g]]
+        if not groups:
+            continue
+        print(("" if first else "\n") + f"=== {title} ===")
+        first = False
+        for g in groups:
+            print(summarize(group_label(summary.group_by, g), summary.groups[g][key]))
+
+    for title, rates in (("Prefix cache and pod affinity", RATES), ("Request hedging", HEDGE_RATES),
+                         ("Errors", ERROR_RATES)):
+        groups = [g for g in sorted(summary.groups) if any(k in summary.groups[g] for k, _, _ in rates)]
+        if not groups:
+            continue
+        print(("" if first else "\n") + f"=== {title} ===")
+        first = False
+        for g in groups:
+            parts = [f"{name}={summary.groups[g][key].mean() * 100:.1f}% (n={summary.groups[g][key].count})"
+                     for key, name, _ in rates if key in summary.groups[g]]
+            print(f"{group_label(summary.group_by, g)}: " + "  ".join(parts))
+
+HEDGE_TAIL_METRICS = ["cold_ttft", "warm_ttft", "node_ttft", "cold_full", "warm_full", "node_full"]
+HEDGE_PROBE_METRICS = [f"{kind}_{which}_ttft" for kind in HEDGE_KINDS for which in ("probe", "hedgeable")]
+
+def tail_line(name, b, c):
+    parts = [f"{label} {b.quantile(q):.1f} -> {c.quantile(q):.1f} "
+             f"({fmt(pct_change(c.quantile(q), b.quantile(q)), '+.1f', '%')})"
+             for q, label in QUANTILES if label != "p90"]
+    return f"{name}: " + "  ".join(parts)
+
+def print_hedge_tails(tails):
+    """
+    Per --hedge-after setting and kind of request: hedgeable requests' TTFT quantiles next
+    to the unhedged probes' of the same kind, and every latency next to the same target's
+    hedge=off rows.
+    """
+    by_target = defaultdict(dict)
+    for (target, hedge), metrics in tails.groups.items():
+        by_target[target][hedge] = metrics
+    lines = []
+    for target in sorted(by_target):
+        for hedge in sorted(h for h in by_target[target] if h not in ("off", "unknown")):
+            for kind in HEDGE_KINDS:
+                b = by_target[target][hedge].get(f"{kind}_probe_ttft")
+                c = by_target[target][hedge].get(f"{kind}_hedgeable_ttft")
+                if b and c and b.count and c.count:
+                    lines.append(tail_line(f"{target.upper()} hedge={hedge} {kind} ttft, probes (n={b.count}) -> "
+                                           f"hedgeable (n={c.count})", b, c))
+    for target in sorted(by_target):
+        off = by_target[target].get("off")
+        if not off:
+            continue
+        for hedge in sorted(h for h in by_target[target] if h not in ("off", "unknown")):
+            for key in HEDGE_TAIL_METRICS:
+                b, c = off.get(key), by_target[target][hedge].get(key)
+                if not b or not c or not b.count or not c.count:
+                    continue
+                lines.append(tail_line(f"{target.upper()} hedge={hedge} {key} vs hedge=off", b, c))
+    if lines:
+        print("\n=== Hedged vs unhedged tails (ms, negative == faster) ===")
+        print("\n".join(lines))
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarize kv_latency_demo.py results with streaming quantile sketches.")
+    ap.add_argument("paths", nargs="*", help="Result JSONL files (default results.jsonl)")
+    ap.add_argument("--group-by", default="target",
+                    help="Comma-separated row fields to group by, e.g. target,model,topic (default target)")
+    ap.add_argument("--alpha", type=float, default=0.01, help="Relative accuracy of the sketches (default 0.01)")
+    ap.add_argument("--sketch", action="append", default=[],
+                    help="Merge a sketch file saved with --save-sketch (repeatable)")
+    ap.add_argument("--save-sketch", default=None, help="Write the merged sketches to this file")
+    ap.add_argument("--compare", nargs="?", const="lb,gw", default=None, metavar="A,B",
+                    help="Paired comparison of target B against A by prompt index (default lb,gw)")
+    ap.add_argument("--resamples", type=int, default=10000, help="Bootstrap resamples for --compare")
+    ap.add_argument("--confidence", type=float, default=0.95, help="CI level for --compare (default 0.95)")
+    ap.add_argument("--seed", type=int, default=0, help="Bootstrap seed for --compare")
+    ap.add_argument("--metrics", default=None,
+                    help="Join server samples from kv_latency_demo.py --metrics-out to rows by time window")
+    ap.add_argument("--metrics-buckets", type=int, default=10, help="Time slices in the --metrics timeline")
+    ap.add_argument("--save-baseline", default=None,
+                    help="Store this run's sketches and throughput as a regression baseline")
+    ap.add_argument("--baseline", default=None,
+                    help="Compare this run against a --save-baseline file; exit 1 on a significant regression")
+    ap.add_argument("--max-regress-pct", type=float, default=10.0,
+                    help="Regression threshold for p50/p99 latency and req/s, in percent (default 10)")
+    ap.add_argument("--p-value", type=float, default=0.01, help="Significance level of the gate tests (default 0.01)")
+    ap.add_argument("--prefix-curve", action="store_true",
+                    help="TTFT savings and prefill throughput by shared-prefix length (make_prompts.py --prefix-sweep rows)")
+    ap.add_argument("--plot", default=None, help="With --prefix-curve: also save the curves to this image (needs matplotlib)")
+    args = ap.parse_args()
+
+    paths = args.paths or ([] if args.sketch else ["results.jsonl"])
+    group_by = [f.strip() for f in args.group_by.split(",") if f.strip()]
+    columnar = bool(paths) and all(is_columnar(p) for p in paths)
+    if not columnar and any(is_columnar(p) for p in paths):
+        raise SystemExit("cannot mix npz and JSONL inputs")
+    if not columnar:
+        paths = jsonl_files(paths)
+    if columnar or args.compare:
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            raise SystemExit("npz input and --compare need numpy: pip install numpy")
+
+    if args.prefix_curve:
+        curve, skipped = prefix_curve(curve_rows(paths, columnar), args.alpha)
+        if skipped:
+            print(f"[warn] skipped {skipped} rows without a prefix=<tokens> topic", file=sys.stderr)
+        if not curve:
+            raise SystemExit("no --prefix-sweep rows found (topic must start with prefix=<tokens>)")
+        print_prefix_curve(curve)
+        if args.plot:
+            plot_prefix_curve(curve, args.plot)
+        return
+
+    if args.compare:
+        a, _, b = args.compare.partition(",")
+        if not a or not b:
+            raise SystemExit("--compare takes two targets, e.g. lb,gw")
+        cols = compare_columns_npz(load_columns(paths)) if columnar else compare_columns_jsonl(paths)
+        A, B = pair_rows(*cols, a, b)
+        stats = compare(A, B, args.resamples, args.confidence, args.seed) if len(A) else {}
+        print_compare(stats, a, b, len(A), args.resamples, args.confidence)
+        return
+
+    if columnar:
+        if args.sketch or args.save_sketch or args.save_baseline or args.baseline:
+            raise SystemExit("--sketch/--save-sketch/--save-baseline/--baseline work on JSONL input only")
+        cols = load_columns(paths)
+        print_report(ColumnarSummary(cols, group_by))
+        if "hedge" in cols:
+            print_hedge_tails(ColumnarSummary(cols, ("target", "hedge")))
+        if args.metrics:
+            print_metrics_report(ServerMetrics(args.metrics), metric_rows(paths, group_by, True),
+                                 group_by, args.metrics_buckets)
+        return
+
+    base = base_tp = None
+    if args.baseline:
+        base, base_tp = load_baseline(args.baseline)
+        group_by, args.alpha = list(base.group_by), base.alpha  # sketches only compare like for like
+    summary = Summary(group_by, args.alpha)
+    throughput = Throughput(group_by)
+    tails = Summary(("target", "hedge"), args.alpha, keys=HEDGE_TAIL_METRICS + HEDGE_PROBE_METRICS)
+    for path in args.sketch:
+        summary.merge(Summary.load(path))
+    for path in paths:
+        summary.add_jsonl(path, throughput, tails)
+    if summary.skipped:
+        print(f"[warn] skipped {summary.skipped} unparsable lines", file=sys.stderr)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, summary, throughput, paths)
+        print(f"[baseline] wrote {args.save_baseline}", file=sys.stderr)
+
+    if base is not None:
+        print(f"=== Regression gate vs {args.baseline} (worse by > {args.max_regress_pct:g}% "
+              f"at p < {args.p_value:g}) ===")
+        n = regression_gate(base, base_tp, summary, throughput, args.max_regress_pct, args.p_value)
+        if n:
+            raise SystemExit(f"{n} regression{'s' if n > 1 else ''} against {args.baseline}")
+        print("no regressions")
+        return
+
+    print_report(summary)
+    print_hedge_tails(tails)
+    if args.metrics:
+        print_metrics_report(ServerMetrics(args.metrics), metric_rows(paths, group_by, False),
+                             group_by, args.metrics_buckets)
+    if args.save_sketch:
+        summary.save(args.save_sketch)
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,99 @@
 # kv_latency_demo.py — simple KV-cache latency benchmark for llm-d gateway vs loadbalancer.
 # Reads 'prompts.txt' with pipe-separated fields: prompt1|prompt2|topic
 
-import argparse, json, time, requests, sys
+import argparse, asyncio, ipaddress, itertools, json, math, mmap, os, random, socket, time, sys
+from collections import defaultdict, deque
+from array import array
+import httpx
+
+# ---------------- Prompt file ----------------
+# prompts.txt is memory-mapped and addressed through a byte-offset index of line starts,
+# so any row is one slice away instead of a rescan from the top. The index is cached
+# next to the file as '<file>.idx' and rebuilt when the file's size or mtime changes.
+
+INDEX_MAGIC = b"KVIDX1\0\0"
+
+class PromptFile:
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "rb")
+        st = os.fstat(self._f.fileno())
+        if st.st_size == 0:
+            raise SystemExit(f"No prompt pairs in {path}")
+        self.mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = self._load_index(st) or self._build_index(st)
+
+    def _load_index(self, st):
+        try:
+            with open(self.path + ".idx", "rb") as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return None
+                stamp = array("Q")
+                stamp.fromfile(f, 2)
+                if tuple(stamp) != (st.st_size, st.st_mtime_ns):
+                    return None
+                offsets = array("Q")
+                offsets.frombytes(f.read())
+                return offsets
+        except (OSError, EOFError):
+            return None
+
+    def _build_index(self, st):
+        offsets = array("Q")
+        mm, size, pos = self.mm, st.st_size, 0
+        while pos < size:
+            offsets.append(pos)
+            nl = mm.find(b"\n", pos)
+            if nl < 0:
+                break
+            pos = nl + 1
+        try:
+            with open(self.path + ".idx", "wb") as f:
+                f.write(INDEX_MAGIC)
+                array("Q", (st.st_size, st.st_mtime_ns)).tofile(f)
+                offsets.tofile(f)
+        except OSError as e:
+            print(f"[warn] could not cache prompt index: {e}", file=sys.stderr)
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def pair(self, index):
+        """Returns (index, prompt1, prompt2, topic) for one row; ValueError for a bad index or row."""
+        if not 0 <= index < len(self.offsets):
+            raise ValueError(f"Index {index} out of range for {self.path}")
+        start = self.offsets[index]
+        end = self.offsets[index + 1] if index + 1 < len(self.offsets) else len(self.mm)
+        parts = self.mm[start:end].decode("utf-8").rstrip("\r\n").split("|", 2)
+        if len(parts) < 2:
+            raise ValueError(f"Line {index} malformed (needs at least 2 fields separated by '|').")
+        topic = parts[2].strip() if len(parts) >= 3 else None
+        return index, parts[0].strip(), parts[1].strip(), topic
+
+    def close(self):
+        self.mm.close()
+        self._f.close()
 
 def read_pair(path, index):
     """Reads one prompt pair (pipe-separated)."""
-    with open(path, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f):
-            if i == index:
-                parts = line.rstrip("\n").split("|", 2)
-                if len(parts) < 2:
-                    raise SystemExit(f"Line {index} malformed (needs at least 2 fields separated by '|').")
-                p1, p2 = parts[0].strip(), parts[1].strip()
-                topic = parts[2].strip() if len(parts) >= 3 else None
-                return p1, p2, topic
-    raise SystemExit(f"Index {index} out of range for {path}")
+    pf = PromptFile(path)
+    try:
+        return pf.pair(index)[1:]
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        pf.close()
+
+def parse_indices(spec, n):
+    """'A:B' (end exclusive, either side optional, negatives count from the end) -> range."""
+    start, sep, stop = spec.partition(":")
+    if not sep:
+        raise SystemExit(f"--indices must look like START:END, got {spec!r}")
+    try:
+        return range(n)[slice(int(start) if start else None, int(stop) if stop else None)]
+    except ValueError:
+        raise SystemExit(f"--indices must look like START:END, got {spec!r}")
 
 def pick_endpoint(mode, lb_url, gw_url):
     if mode == "lb":
@@ -28,64 +107,411 @@ def pick_endpoint(mode, lb_url, gw_url):
         return gw_url.rstrip("/")
     raise SystemExit("mode must be lb or gw")
 
-def post_once(base, model, prompt, timeout, stream, close_conn):
+# ---------------- HTTP client ----------------
+# One httpx.AsyncClient is shared by every request of a run so keep-alive connections
+# are pooled (optionally over HTTP/2). With conn="fresh" every request opens a new
+# TCP (+TLS) connection instead, which is what round-robin L4 balancing needs: a
+# reused connection always lands on the same pod behind a Service LoadBalancer.
+#
+# Connection phases come from httpcore's trace hook. httpcore resolves DNS inside
+# connect_tcp, so we resolve the host ourselves and connect to the address directly
+# (Host header / SNI keep the original name) to report DNS on its own.
+
+TRACE_CONNECT = ("connection.connect_tcp.started", "connection.connect_tcp.complete")
+TRACE_TLS = ("connection.start_tls.started", "connection.start_tls.complete")
+TRACE_SENT = ("http11.send_request_headers.started", "http2.send_request_headers.started")
+TRACE_HEADERS = ("http11.receive_response_headers.complete", "http2.receive_response_headers.complete")
+
+# Response headers that name the pod which served a request, first match wins. vLLM sets
+# none itself: sim_server.py sends x-sim-pod, and on a cluster the gateway or a sidecar has
+# to add one (e.g. echo the EPP's x-gateway-destination-endpoint back). --pod-header adds more.
+POD_HEADERS = ("x-sim-pod", "x-gateway-destination-endpoint", "x-backend-pod", "x-served-by")
+
+class BenchClient:
+    def __init__(self, base, timeout, conn="pooled", http2=False, max_conns=256, transport=None,
+                 pod_headers=POD_HEADERS):
+        self.url = httpx.URL(f"{base}/v1/chat/completions")
+        self.host = self.url.host
+        self.port = self.url.port or (443 if self.url.scheme == "https" else 80)
+        self.authority = self.url.netloc.decode("ascii")
+        self.conn = conn
+        self.http2 = http2
+        self.pod_headers = tuple(pod_headers)
+        self.hedger = None
+        self._addr = None
+        limits = httpx.Limits(max_connections=max_conns,
+                              max_keepalive_connections=0 if conn == "fresh" else max_conns)
+        try:
+            self.http = httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout, transport=transport)
+        except ImportError:
+            raise SystemExit("--http2 needs the h2 package: pip install 'httpx[http2]'")
+
+    async def resolve(self):
+        """Returns (address, dns_s). Pooled clients resolve once, fresh ones before every request."""
+        try:
+            ipaddress.ip_address(self.host)
+            return self.host, None
+        except ValueError:
+            pass
+        if self._addr is not None and self.conn != "fresh":
+            return self._addr, None
+        t0 = time.perf_counter()
+        infos = await asyncio.get_running_loop().getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        dns_s = time.perf_counter() - t0
+        self._addr = infos[0][4][0]
+        return self._addr, dns_s
+
+    async def request_args(self, marks):
+        """Builds (url, headers, extensions, dns_s) for one request; marks collects trace timestamps."""
+        addr, dns_s = await self.resolve()
+
+        async def trace(event, info):
+            marks[event] = time.perf_counter()
+
+        headers = {"Content-Type": "application/json", "Host": self.authority}
+        if self.conn == "fresh" and not self.http2:
+            headers["Connection"] = "close"  # let the server drop it too
+        extensions = {"trace": trace}
+        if self.url.scheme == "https":
+            extensions["sni_hostname"] = self.host
+        return self.url.copy_with(host=addr), headers, extensions, dns_s
+
+    @property
+    def hedge_label(self):
+        return self.hedger.label if self.hedger else "off"
+
+    async def aclose(self):
+        if self.hedger and self.hedger.backup is not self:
+            await self.hedger.backup.aclose()
+        await self.http.aclose()
+
+def make_client(base, args, hedge=True):
+    conn = args.conn
+    if conn == "auto":
+        conn = "fresh" if args.mode == "lb" else "pooled"
+    client = BenchClient(base, args.timeout, conn=conn, http2=args.http2,
+                         max_conns=max(1, getattr(args, "max_inflight", 1)),
+                         pod_headers=tuple(getattr(args, "pod_header", ())) + POD_HEADERS)
+    if hedge and getattr(args, "hedge_after", None):
+        hedge_url = args.hedge_url.rstrip("/") if args.hedge_url else None
+        backup = make_client(hedge_url, args, hedge=False) if hedge_url and hedge_url != base else client
+        client.hedger = Hedger(args.hedge_after, backup, args.hedge_probe_every, seed=getattr(args, "seed", 0))
+    return client
+
+def phases_ms(marks, dns_s):
+    """Connection-phase timings (ms) of one request; connect/tls are None on a reused connection."""
+    def span(start, end):
+        if start in marks and end in marks:
+            return round((marks[end] - marks[start]) * 1000, 2)
+        return None
+
+    sent = next((marks[k] for k in TRACE_SENT if k in marks), None)
+    hdrs = next((marks[k] for k in TRACE_HEADERS if k in marks), None)
+    connect_ms = span(*TRACE_CONNECT)
+    return {
+        "dns_ms": round(dns_s * 1000, 2) if dns_s is not None else None,
+        "connect_ms": connect_ms,
+        "tls_ms": span(*TRACE_TLS),
+        "ttfb_ms": round((hdrs - sent) * 1000, 2) if sent is not None and hdrs is not None else None,
+        "conn_reused": connect_ms is None,
+    }
+
+def token_stats(token_times, usage):
+    """
+    Decode-side metrics of one streamed response from the arrival times of its content chunks.
+
+    - itl_us: inter-token latencies (gaps between content chunks) in whole microseconds
+    - tpot_ms: time per output token after the first, using usage.completion_tokens when present
+    - decode_tps: output tokens per second after the first token
+    """
+    gaps = [round((b - a) * 1e6) for a, b in zip(token_times, token_times[1:])]
+    itl = sorted(gaps)
+    n_tokens = (usage or {}).get("completion_tokens") or len(token_times)
+    decode_s = token_times[-1] - token_times[0] if len(token_times) > 1 else 0.0
+    per_token = decode_s / (n_tokens - 1) if n_tokens > 1 and decode_s > 0 else None
+    return {
+        "itl_us": gaps,
+        "itl_p50_ms": round(percentile(itl, 50) / 1000, 2) if itl else None,
+        "itl_p99_ms": round(percentile(itl, 99) / 1000, 2) if itl else None,
+        "tpot_ms": round(per_token * 1000, 2) if per_token else None,
+        "decode_tps": round(1.0 / per_token, 2) if per_token else None,
+    }
+
+def attribution(client, headers, usage):
+    """Which pod served a request (from client.pod_headers) and how many prompt tokens were cached."""
+    pod = next((headers[h] for h in client.pod_headers if h in headers), None)
+    details = (usage or {}).get("prompt_tokens_details") or {}
+    return {"pod": pod, "cached_tokens": details.get("cached_tokens")}
+
+NO_TOKEN_STATS = {"itl_us": None, "itl_p50_ms": None, "itl_p99_ms": None, "tpot_ms": None, "decode_tps": None}
+
+def has_content(obj):
+    for choice in obj.get("choices") or ():
+        delta = choice.get("delta") or {}
+        if delta.get("content") or delta.get("reasoning_content"):
+            return True
+    return False
+
+# ---------------- SSE parsing ----------------
+# The stream is scanned as raw bytes: each network read is timestamped once, split into
+# "data:" payloads, and only inspected with byte searches. json.loads runs only on the
+# chunk carrying usage (plus the last chunk, if none did), not once per token.
+# Quotes inside JSON strings are escaped, so a needle like b'"content":' can only
+# match a key, never token text.
+
+def value_start(data, key):
+    """First two bytes of the value following the first occurrence of key (b'"name":')."""
+    i = data.find(key)
+    if i < 0:
+        return b""
+    i += len(key)
+    while data[i:i + 1] == b" ":
+        i += 1
+    return data[i:i + 2]
+
+def payload_has_content(data):
+    """Byte-level has_content(): a non-empty content or reasoning_content delta."""
+    for key in (b'"content":', b'"reasoning_content":'):
+        v = value_start(data, key)
+        if v[:1] == b'"' and v != b'""':
+            return True
+    return False
+
+class SSEParser:
+    """Incremental SSE decoder: feed(bytes) returns the data payloads of the complete lines."""
+
+    def __init__(self):
+        self.buf = b""
+
+    def feed(self, chunk):
+        lines = (self.buf + chunk if self.buf else chunk).split(b"\n")
+        self.buf = lines.pop()
+        return [line[5:].strip() for line in lines if line.startswith(b"data:")]
+
+class StreamScan:
+    """Per-response state: first-event time, content-chunk arrival times, decoded usage chunk."""
+
+    def __init__(self, first_event=None):
+        self.parser = SSEParser()
+        self.first = None
+        self.first_event = first_event  # asyncio.Event set with the first event (hedging)
+        self.token_times = []
+        self.last = None
+        self.last_data = None
+        self.done = False
+
+    def feed(self, chunk, now):
+        for data in self.parser.feed(chunk):
+            if data == b"[DONE]":
+                self.done = True
+                return
+            if self.first is None:
+                self.first = now
+                if self.first_event is not None:
+                    self.first_event.set()
+            if payload_has_content(data):
+                self.token_times.append(now)
+            if value_start(data, b'"usage":')[:1] == b"{":
+                try:
+                    self.last = json.loads(data)
+                except ValueError:
+                    pass
+            self.last_data = data
+
+    def final(self):
+        """The decoded usage chunk, else the last chunk decoded now, else {}."""
+        if self.last is None and self.last_data is not None:
+            try:
+                self.last = json.loads(self.last_data)
+            except ValueError:
+                pass
+        return self.last if isinstance(self.last, dict) else {}
+
+async def post_once(client, model, prompt, stream, max_tokens=128, scan=None):
     """
-    Makes one /v1/chat/completions call and returns (ttft_s, full_s, json_response).
+    Makes one /v1/chat/completions call and returns (ttft_s, full_s, json_response, stats).
+    prompt is a user message string or a full list of chat messages.
 
     - TTFT (Time To First Token) is measured only in streaming mode (time to first streamed token).
       If not streaming or no token arrives, we fall back to full time for TTFT.
+    - TTFT/full include connection setup; stats breaks out dns/connect/tls/ttfb (request sent
+      to response headers) so setup cost can be separated from prefill time.
+    - In streaming mode stats also carries per-token decode metrics (see token_stats).
+    - stats["ts_start"] is the wall-clock send time (epoch seconds).
+    - stats["pod"]/stats["cached_tokens"] attribute the request (see attribution); None when
+      the response has no pod header or the server does not report prompt_tokens_details.
+    - An HTTP status >= 400 raises RuntimeError, so a 429/503 counts as a failed request.
+    - scan, if given, is the StreamScan to fill, so a caller can watch a stream it may cancel.
     """
-    url = f"{base}/v1/chat/completions"
     payload = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 128,
+        "messages": prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}],
+        "max_tokens": max_tokens,
         "temperature": 0.2,
         "stream": bool(stream),
     }
     if stream:
         payload["stream_options"] = {"include_usage": True}
+    body = json.dumps(payload)
 
-    headers = {"Content-Type": "application/json"}
-    if close_conn:
-        headers["Connection"] = "close"  # force fresh TCP for LB mode
-
+    marks = {}
+    started = round(time.time(), 4)  # wall clock, to line rows up with --metrics-url samples
     t0 = time.perf_counter()
+    url, headers, extensions, dns_s = await client.request_args(marks)
 
     # Non-streaming mode: TTFT == full time (no partial measurements available)
     if not stream:
-        with requests.Session() as s:
-            r = s.post(url, headers=headers, data=json.dumps(payload), timeout=timeout)
+        r = await client.http.post(url, headers=headers, content=body, extensions=extensions)
         t1 = time.perf_counter()
+        if r.status_code >= 400:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
         try:
             j = r.json()
         except Exception:
             j = {"status": r.status_code, "text": r.text}
         elapsed = t1 - t0
-        return elapsed, elapsed, j
+        usage = j.get("usage") if isinstance(j, dict) else None
+        return elapsed, elapsed, j, {"ts_start": started, **phases_ms(marks, dns_s),
+                                     **attribution(client, r.headers, usage), **NO_TOKEN_STATS}
 
     # Streaming mode: measure true TTFT when the first token arrives
-    with requests.Session() as s:
-        r = s.post(url, headers=headers, data=json.dumps(payload), timeout=timeout, stream=True)
-        ttft = None
-        last = {}
-        for line in r.iter_lines(decode_unicode=True):
-            if not line or not line.startswith("data:"):
-                continue
-            data = line[5:].strip()
-            if data == "[DONE]":
+    scan = scan or StreamScan()
+    async with client.http.stream("POST", url, headers=headers, content=body, extensions=extensions) as r:
+        resp_headers = r.headers
+        if r.status_code >= 400:
+            await r.aread()
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+        async for chunk in r.aiter_bytes():
+            scan.feed(chunk, time.perf_counter())
+            if scan.done:
                 break
-            try:
-                obj = json.loads(data)
-                last = obj
-            except Exception:
-                continue
-            if ttft is None:
-                ttft = time.perf_counter() - t0
-        t1 = time.perf_counter()
-        if ttft is None:
-            ttft = t1 - t0
-        return ttft, (t1 - t0), last
+    t1 = time.perf_counter()
+    ttft = (scan.first if scan.first is not None else t1) - t0
+    last = scan.final()
+    tokens = token_stats(scan.token_times, last.get("usage")) if scan.token_times else NO_TOKEN_STATS
+    return ttft, (t1 - t0), last, {"ts_start": started, **phases_ms(marks, dns_s),
+                                   **attribution(client, resp_headers, last.get("usage")), **tokens}
+
+# ---------------- Hedging ----------------
+# --hedge-after sends a duplicate of a request when it has produced no first token (no
+# response, without --stream) after a delay: a fixed number of ms, or pNN of the TTFTs the
+# client has seen (no hedging until 20 have been). The duplicate goes to --hedge-url, or
+# to the same URL: with lb and fresh connections that is another round-robin pick. The
+# first of the two to stream a token wins and the other is cancelled, which closes its
+# connection so vLLM aborts it. The winner's TTFT/full time count from the original send.
+# Each request is a probe that is never hedged with chance 1/--hedge-probe-every (drawn
+# from a --seed'ed generator), and so are, for pNN, the first 20 of each kind. Probes are
+# a random sample of what requests see without hedging: the pNN delay is learned from
+# them alone (hedged winners, or only the requests that beat the delay, would pull it
+# down over time), and their TTFT tail is the in-run baseline for the hedged requests'.
+# Cold, warm and node (tree/trace) requests have very different TTFTs, so each kind
+# learns its own delay from its own probes. Per request stats: hedge_probe, hedged (duplicate sent),
+# hedge_won (duplicate won), hedge_delay_ms and wasted_tokens, the content chunks the
+# cancelled loser had already streamed (None without --stream, where it is unknown).
+
+HEDGE_MIN_SAMPLES = 20
+
+class Hedger:
+    def __init__(self, spec, backup, probe_every=10, window=1000, seed=0):
+        self.label = spec
+        self.backup = backup
+        self.probe_every = probe_every
+        self.rnd = random.Random(seed)
+        self.recent = defaultdict(lambda: deque(maxlen=window))  # kind -> probe TTFTs (s)
+        try:
+            if spec.lower().startswith("p"):
+                self.q, self.fixed_s = float(spec[1:]), None
+                if not 0 < self.q < 100:
+                    raise ValueError
+            else:
+                self.q, self.fixed_s = None, float(spec) / 1000.0
+        except ValueError:
+            raise SystemExit(f"--hedge-after must be milliseconds (e.g. 250) or a percentile (e.g. p95), got {spec!r}")
+        if self.q is not None and probe_every < 1:
+            raise SystemExit("--hedge-after pNN learns from probes: --hedge-probe-every must be >= 1")
+
+    def delay(self, kind):
+        """Seconds a kind ("cold", "warm", "node") of request waits before hedging, or None for a probe."""
+        if self.probe_every and self.rnd.random() * self.probe_every < 1:
+            return None
+        if self.fixed_s is not None:
+            return self.fixed_s
+        recent = self.recent[kind]
+        if len(recent) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(sorted(recent), self.q)
+
+    def observe(self, kind, probe_ttft_s):
+        self.recent[kind].append(probe_ttft_s)
+
+NO_HEDGE_STATS = {"hedge_probe": False, "hedged": False, "hedge_won": False, "hedge_delay_ms": None,
+                  "wasted_tokens": 0}
+
+async def post_hedged(client, model, prompt, stream, max_tokens=128, kind="node"):
+    """post_once with a duplicate on client.hedger.backup if no first token arrives in time."""
+    hedger = client.hedger
+    delay = hedger.delay(kind)
+    if delay is None:
+        result = await post_once(client, model, prompt, stream, max_tokens)
+        hedger.observe(kind, result[0])
+        result[3].update(NO_HEDGE_STATS, hedge_probe=True)
+        return result
+
+    t0 = time.perf_counter()
+    racers = {}  # task -> (scan, offset_s, is_backup)
+
+    def start(target, is_backup):
+        scan = StreamScan(asyncio.Event())
+        task = asyncio.create_task(post_once(target, model, prompt, stream, max_tokens, scan=scan))
+        racers[task] = (scan, time.perf_counter() - t0, is_backup)
+        return task
+
+    primary = start(client, False)
+    first = asyncio.create_task(racers[primary][0].first_event.wait())
+    done, _ = await asyncio.wait({primary, first}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+    first.cancel()
+    if done:
+        result = await primary
+        result[3].update(NO_HEDGE_STATS, hedge_delay_ms=round(delay * 1000, 2))
+        return result
+
+    start(hedger.backup, True)
+    winner, error = None, None
+    while winner is None and racers:
+        waits = {asyncio.create_task(scan.first_event.wait()): task for task, (scan, _, _) in racers.items()}
+        done, _ = await asyncio.wait(set(waits) | set(racers), return_when=asyncio.FIRST_COMPLETED)
+        for w in waits:
+            w.cancel()
+        for d in done:
+            task = waits.get(d, d)
+            if task in racers and task.done() and task.exception() is not None:
+                error = task.exception()
+                del racers[task]  # failed before winning; the other one may still answer
+            elif task in racers:
+                winner = task
+                break
+
+    if winner is None:
+        raise error
+    wasted = 0 if stream else None
+    for task, (scan, _, _) in racers.items():
+        if task is not winner:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if stream:
+                wasted += len(scan.token_times)
+    _, offset, is_backup = racers[winner]
+    ttft, full, j, stats = await winner
+    ttft, full = ttft + offset, full + offset
+    stats.update(NO_HEDGE_STATS, hedged=True, hedge_won=is_backup, hedge_delay_ms=round(delay * 1000, 2),
+                 wasted_tokens=wasted)
+    return ttft, full, j, stats
+
+async def send_request(client, model, prompt, stream, max_tokens=128, kind="node"):
+    """One measured request: post_once, hedged when --hedge-after is set (kind: cold, warm or node)."""
+    if client.hedger:
+        return await post_hedged(client, model, prompt, stream, max_tokens, kind)
+    return await post_once(client, model, prompt, stream, max_tokens)
 
 def pct_improve_ms(cold_ms, warm_ms):
     """Return percent improvement: (cold - warm) / cold * 100. None if cold<=0."""
@@ -93,41 +519,10 @@ def pct_improve_ms(cold_ms, warm_ms):
         return None
     return round(((cold_ms - warm_ms) / cold_ms) * 100.0, 2)
 
-def main():
-    ap = argparse.ArgumentParser(description="KV-cache latency demo for llm-d gateway vs loadbalancer.")
-    ap.add_argument("--file", default="prompts.txt", help="Pipe-separated file: prompt1|prompt2|topic")
-    ap.add_argument("--index", type=int, required=True)
-    ap.add_argument("--mode", choices=["lb", "gw"], required=True)
-    ap.add_argument("--lb-url", default=None)
-    ap.add_argument("--gw-url", default=None)
-    ap.add_argument("--model", default="Qwen/Qwen3-0.6B")
-    ap.add_argument("--timeout", type=float, default=90.0)
-    ap.add_argument("--warmup", type=int, default=0)
-    ap.add_argument("--stream", action="store_true", help="Use streaming to measure TTFT")
-    ap.add_argument("--jsonl", default="results.jsonl")
-    args = ap.parse_args()
-
-    base = pick_endpoint(args.mode, args.lb_url, args.gw_url)
-    p1, p2, topic = read_pair(args.file, args.index)
-
-    # Optional warmup requests (not recorded)
-    for _ in range(max(0, args.warmup)):
-        try:
-            post_once(base, args.model, "warm up", args.timeout, stream=False,
-                      close_conn=(args.mode == "lb"))
-        except Exception as e:
-            print(f"[warmup] {e}", file=sys.stderr)
-
-    # Cold call
-    cold_ttft_s, cold_full_s, cold_json = post_once(
-        base, args.model, p1, args.timeout, args.stream, close_conn=(args.mode == "lb")
-    )
-    time.sleep(0.05)
-
-    # Warm call (related continuation)
-    warm_ttft_s, warm_full_s, warm_json = post_once(
-        base, args.model, p2, args.timeout, args.stream, close_conn=(args.mode == "lb")
-    )
+def build_row(mode, base, index, topic, model, cold, warm, conn=None):
+    """Turns (ttft_s, full_s, json, stats) results of a cold/warm pair into one result row."""
+    cold_ttft_s, cold_full_s, cold_json, cold_stats = cold
+    warm_ttft_s, warm_full_s, warm_json, warm_stats = warm
 
     # Convert to ms then compute deltas and improvements
     cold_ttft_ms = round(cold_ttft_s * 1000, 2)
@@ -136,11 +531,11 @@ def main():
     warm_full_ms = round(warm_full_s * 1000, 2)
 
     row = {
-        "target": args.mode,
+        "target": mode,
         "base_url": base,
-        "index": args.index,
+        "index": index,
         "topic": topic,
-        "model": args.model,
+        "model": model,
         "cold_ttft_ms": cold_ttft_ms,
         "cold_full_ms": cold_full_ms,
         "warm_ttft_ms": warm_ttft_ms,
@@ -151,14 +546,1239 @@ def main():
         "improve_full_pct": pct_improve_ms(cold_full_ms, warm_full_ms),   # positive == faster on warm
         "usage_cold": cold_json.get("usage") if isinstance(cold_json, dict) else None,
         "usage_warm": warm_json.get("usage") if isinstance(warm_json, dict) else None,
+        "conn": conn,
+    }
+    for prefix, stats in (("cold", cold_stats), ("warm", warm_stats)):
+        for k, v in stats.items():
+            row[f"{prefix}_{k}"] = v
+    return row
+
+def build_node_row(mode, base, node, model, result, conn=None):
+    """One result row per request of a prefix-tree replay (see --tree)."""
+    ttft_s, full_s, j, stats = result
+    row = {
+        "target": mode,
+        "base_url": base,
+        "tree": node["tree"],
+        "node": node["node"],
+        "parent": node["parent"],
+        "depth": node["depth"],
+        "topic": node.get("topic"),
+        "model": model,
+        "ttft_ms": round(ttft_s * 1000, 2),
+        "full_ms": round(full_s * 1000, 2),
+        "usage": j.get("usage") if isinstance(j, dict) else None,
+        "conn": conn,
+    }
+    row.update(stats)
+    return row
+
+def error_row(mode, base, model, exc, client):
+    """Result row for a failed session, so analyze_results.py can count error rates."""
+    return {
+        "target": mode,
+        "base_url": base,
+        "model": model,
+        "conn": client.conn,
+        "hedge": client.hedge_label,
+        "error": f"{type(exc).__name__}: {exc}",
+    }
+
+# ---------------- JSONL output ----------------
+# Rows are queued in memory and written by a writer thread in batches: as soon as
+# --flush-rows rows are waiting, else every --flush-seconds (also while no rows arrive),
+# and on close. The thread encodes a batch and appends it with a single write to a file
+# kept open for the whole run, so the event loop never waits on json.dumps or the disk
+# between requests. A batch that fails to write is counted and reported on close.
+# --jsonl - sends the rows to stdout instead of a file.
+
+class JsonlWriter:
+    def __init__(self, path, flush_rows=1000, flush_seconds=1.0):
+        import threading
+        self.path = path
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self.pending = deque()  # append (event loop) and popleft (writer thread) are thread-safe
+        self.written = 0  # rows on disk; lines in the file for --workers manifests
+        self.failed = 0
+        self.error = None
+        self.closing = False
+        self.wake = threading.Event()
+        self.out = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self.thread.start()
+
+    def add(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.flush_rows:
+            self.wake.set()
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            closing = self.closing  # read before draining, so rows added before close are written
+            batch = []
+            while self.pending:
+                batch.append(self.pending.popleft())
+            if batch:
+                try:
+                    self.out.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch))
+                    self.out.flush()
+                    self.written += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    self.error = e
+            if closing:
+                return
+
+    def close(self):
+        self.closing = True
+        self.wake.set()
+        self.thread.join()
+        if self.out is not sys.stdout:
+            try:
+                self.out.close()
+            except OSError as e:  # a failed batch left in the file buffer; already counted
+                self.error = self.error or e
+        if self.failed:
+            print(f"[warn] {self.failed} of {self.written + self.failed} rows could not be written to "
+                  f"{self.path}: {self.error}", file=sys.stderr)
+
+# ---------------- Columnar output ----------------
+# --npz DIR writes rows column-wise as compressed NumPy chunks (DIR/chunk-000000.npz, ...),
+# read back by analyze_results.py without any per-row JSON parsing. Missing values are NaN,
+# usage is flattened to token counts and the itl_us arrays are stored ragged as
+# <name> (all values) + <name>_len (values per row).
+
+STRING_COLUMNS = ["target", "base_url", "topic", "model", "conn", "session", "pod", "cold_pod", "warm_pod", "hedge",
+                  "error"]
+NUMERIC_COLUMNS = [
+    "tree", "node", "parent", "depth", "ts_start", "ttft_ms", "full_ms",
+    "seq", "t_s", "lateness_ms", "sched_ttft_ms", "sched_full_ms", "trial", "repeat", "gap_s",
+    "queue_ms", "cold_sched_ttft_ms", "cold_sched_full_ms",
+    "index", "cold_ttft_ms", "cold_full_ms", "warm_ttft_ms", "warm_full_ms",
+    "delta_ttft_ms", "delta_full_ms", "improve_ttft_pct", "improve_full_pct",
+    "cached_tokens", "prompt_tokens", "completion_tokens",
+    "hedge_probe", "hedged", "hedge_won", "hedge_delay_ms", "wasted_tokens",
+] + [f"{prefix}_{name}" for prefix in ("cold", "warm") for name in (
+    "ts_start", "dns_ms", "connect_ms", "tls_ms", "ttfb_ms", "conn_reused",
+    "itl_p50_ms", "itl_p99_ms", "tpot_ms", "decode_tps", "prompt_tokens", "completion_tokens",
+    "cached_tokens", "hedge_probe", "hedged", "hedge_won", "hedge_delay_ms", "wasted_tokens",
+)]
+RAGGED_COLUMNS = ["cold_itl_us", "warm_itl_us", "itl_us"]
+
+def column_value(row, name):
+    if name in ("prompt_tokens", "completion_tokens"):
+        return (row.get("usage") or {}).get(name)
+    if name.endswith(("_prompt_tokens", "_completion_tokens")):
+        prefix, _, key = name.partition("_")
+        usage = row.get(f"usage_{prefix}") or {}
+        return usage.get(key)
+    return row.get(name)
+
+class NpzWriter:
+    def __init__(self, directory, chunk_rows=10000, prefix="chunk-"):
+        try:
+            import numpy
+        except ImportError:
+            raise SystemExit("--npz needs numpy: pip install numpy")
+        self.np = numpy
+        self.directory = directory
+        self.chunk_rows = max(1, chunk_rows)
+        self.prefix = prefix
+        self.rows = []
+        os.makedirs(directory, exist_ok=True)
+        self.seq = len([n for n in os.listdir(directory)
+                        if n.startswith(prefix) and n[len(prefix):-4].isdigit() and n.endswith(".npz")])
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        np, rows = self.np, self.rows
+        cols = {}
+        for name in STRING_COLUMNS:
+            cols[name] = np.array([str(r.get(name) or "") for r in rows])
+        for name in NUMERIC_COLUMNS:
+            vals = (column_value(r, name) for r in rows)
+            cols[name] = np.array([np.nan if v is None else float(v) for v in vals], dtype=np.float64)
+        for name in RAGGED_COLUMNS:
+            lists = [r.get(name) or [] for r in rows]
+            cols[name] = np.array([v for vals in lists for v in vals], dtype=np.int64)
+            cols[f"{name}_len"] = np.array([len(vals) for vals in lists], dtype=np.int64)
+        path = os.path.join(self.directory, f"{self.prefix}{self.seq:06d}.npz")
+        with open(path + ".tmp", "wb") as f:
+            np.savez_compressed(f, **cols)
+        os.replace(path + ".tmp", path)  # readers never see a half-written chunk
+        self.seq += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+class ResultWriter:
+    """Where result rows go: --jsonl (unless empty; '-' for stdout) and, with --npz, columnar chunks."""
+
+    def __init__(self, args):
+        self.jsonl = JsonlWriter(args.jsonl, args.flush_rows, args.flush_seconds) if args.jsonl else None
+        self.npz = NpzWriter(args.npz, args.npz_chunk, getattr(args, "npz_prefix", "chunk-")) if args.npz else None
+
+    def write(self, row):
+        if self.jsonl:
+            self.jsonl.add(row)
+        if self.npz:
+            self.npz.add(row)
+
+    def close(self):
+        if self.jsonl:
+            self.jsonl.close()
+        if self.npz:
+            self.npz.close()
+
+async def warmup(client, args):
+    """Optional warmup requests (not recorded)."""
+    for _ in range(max(0, args.warmup)):
+        try:
+            await post_once(client, args.model, "warm up", stream=False)
+        except Exception as e:
+            print(f"[warmup] {e}", file=sys.stderr)
+
+# ---------------- Concurrent load mode ----------------
+# Each session is one cold/warm pair (or one prefix tree with --tree). Sessions are started either open-loop
+# (fixed or Poisson arrivals at --qps, independent of how fast the server answers)
+# or closed-loop (--users sessions in flight, each starting the next one when done).
+
+def percentile(sorted_vals, q):
+    """Nearest-rank percentile of an already sorted list (q in 0..100)."""
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(q * len(sorted_vals) / 100.0) - 1))
+    return sorted_vals[k]
+
+async def run_session(client, base, args, pair, gap=0.05):
+    index, p1, p2, topic = pair
+    cold = await send_request(client, args.model, p1, args.stream, kind="cold")
+    await asyncio.sleep(gap)
+    warm = await send_request(client, args.model, p2, args.stream, kind="warm")
+    row = build_row(args.mode, base, index, topic, args.model, cold, warm, conn=client.conn)
+    row["hedge"] = client.hedge_label
+    return row
+
+async def run_one_pair(client, base, args, pair):
+    return [await run_session(client, base, args, pair)]
+
+async def run_single(base, args, pair):
+    client = make_client(base, args)
+    try:
+        await warmup(client, args)
+        return await run_session(client, base, args, pair)
+    finally:
+        await client.aclose()
+
+# ---------------- Prefix-tree replay ----------------
+# --tree replays the JSONL prefix trees written by make_prompts.py --tree. Each tree is one
+# session: a node is sent as its ancestors' messages plus its own once its parent has
+# answered, and siblings (users sharing that prefix) are sent concurrently.
+
+def read_trees(path):
+    """Yields the node list of each tree; a tree's nodes are contiguous, parents first."""
+    nodes = []
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                node = json.loads(line)
+            except Exception:
+                raise SystemExit(f"Line {i} of {path} is not valid JSON")
+            if nodes and node["tree"] != nodes[0]["tree"]:
+                yield nodes
+                nodes = []
+            nodes.append(node)
+    if nodes:
+        yield nodes
+
+async def run_tree(client, base, args, nodes):
+    children = defaultdict(list)
+    for node in nodes[1:]:
+        children[node["parent"]].append(node)
+    rows = []
+
+    async def visit(node, history):
+        messages = history + node["messages"]
+        result = await send_request(client, args.model, messages, args.stream)
+        rows.append(build_node_row(args.mode, base, node, args.model, result, conn=client.conn))
+        rows[-1]["hedge"] = client.hedge_label
+        await asyncio.gather(*(visit(c, messages) for c in children[node["node"]]))
+
+    await visit(nodes[0], [])
+    return rows
+
+# ---------------- Trace replay ----------------
+# --trace FILE replays recorded traffic: one JSON object per line with the arrival time
+# "t" (seconds; epoch or relative, only differences matter), "session", "messages" and
+# optionally "max_tokens". Lines must be in arrival order. Every request is sent at its
+# own scheduled time (first arrival + (t - t_first) / --speed) whether or not earlier
+# ones have answered, so a slow server cannot hold back the schedule (no coordinated
+# omission). lateness_ms records how far behind schedule each request actually went out;
+# sched_ttft_ms/sched_full_ms are measured from the scheduled time instead of the send.
+
+def read_trace(path):
+    """Yields trace records with "seq" (line order) and "t" rebased to the first arrival."""
+    t_first = None
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+                t = float(rec["t"])
+            except Exception:
+                raise SystemExit(f"Line {i} of {path} is not a trace record with a numeric \"t\"")
+            if t_first is None:
+                t_first = t
+            rec["seq"] = i
+            rec["t"] = t - t_first
+            yield rec
+
+def build_trace_row(mode, base, rec, model, result, lateness_s, conn=None):
+    """One result row per replayed trace request."""
+    ttft_s, full_s, j, stats = result
+    row = {
+        "target": mode,
+        "base_url": base,
+        "seq": rec["seq"],
+        "session": rec.get("session"),
+        "t_s": round(rec["t"], 6),
+        "model": model,
+        "ttft_ms": round(ttft_s * 1000, 2),
+        "full_ms": round(full_s * 1000, 2),
+        "lateness_ms": round(lateness_s * 1000, 3),
+        "sched_ttft_ms": round((ttft_s + lateness_s) * 1000, 2),
+        "sched_full_ms": round((full_s + lateness_s) * 1000, 2),
+        "usage": j.get("usage") if isinstance(j, dict) else None,
+        "conn": conn,
+    }
+    row.update(stats)
+    return row
+
+async def run_trace_request(client, base, args, rec):
+    lateness = max(0.0, time.perf_counter() - rec["send_at"])
+    result = await send_request(client, rec.get("model") or args.model, rec["messages"], args.stream,
+                                max_tokens=rec.get("max_tokens") or 128)
+    row = build_trace_row(args.mode, base, rec, rec.get("model") or args.model, result, lateness, conn=client.conn)
+    row["hedge"] = client.hedge_label
+    return [row]
+
+# Open-loop sessions that wait for a --max-inflight slot start late. The wait is recorded
+# as queue_ms on the session's rows, and sched_ttft_ms/sched_full_ms (cold_sched_* on
+# pair rows) add it to the measured latency, so a saturated run cannot hide its queueing
+# (coordinated omission). Trace rows already count it in lateness_ms. The run's pace
+# compares the offered rate (scheduled arrivals) with the rate sessions actually started.
+
+PACE_TOLERANCE = 0.05  # started rate this far below the offered rate is reported as falling behind
+
+def add_queue_wait(row, queue_s):
+    queue_ms = round(queue_s * 1000, 3)
+    row["queue_ms"] = queue_ms
+    prefix = "cold_" if "cold_ttft_ms" in row else ""
+    for metric in ("ttft", "full"):
+        if row.get(f"{prefix}{metric}_ms") is not None:
+            row[f"{prefix}sched_{metric}_ms"] = round(row[f"{prefix}{metric}_ms"] + queue_ms, 2)
+
+def rate(times):
+    times = sorted(times)
+    return (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else None
+
+def behind(pace):
+    """True when sessions started measurably slower than they were offered."""
+    return bool(pace and pace["offered_qps"] and pace["started_qps"] is not None
+                and pace["started_qps"] < pace["offered_qps"] * (1 - PACE_TOLERANCE))
+
+def pace_warning(pace, args):
+    if behind(pace):
+        return (f"WARNING: offered {pace['offered_qps']:.2f} sessions/s but only {pace['started_qps']:.2f}/s "
+                f"started; sessions queued for a --max-inflight slot (max {args.max_inflight}), see queue_ms")
+    return None
+
+async def run_load(base, args, items, run_item, writer, ready=None, offset=0.0):
+    """
+    Runs one session per entry of items concurrently; run_item(client, item) returns the
+    session's result rows. Returns (rows, sessions_ok, errors, elapsed_s, pace), where pace
+    is {"offered_qps", "started_qps"} for open-loop runs and None for closed-loop ones.
+    ready, if given, is awaited after warmup and returns when the run should start;
+    offset delays the first open-loop arrival (used to interleave --workers).
+    """
+    client = make_client(base, args)
+    await warmup(client, args)
+    if ready:
+        await ready()
+    inflight = asyncio.Semaphore(max(1, args.max_inflight))
+    rnd = random.Random(args.seed)
+    rows, done, errors = [], 0, 0
+    next_pair = iter(enumerate(items))
+
+    scheduled, started = [], []
+
+    async def one(k, item, queue_s=None):
+        nonlocal done, errors
+        try:
+            out = await run_item(client, item)
+        except Exception as e:
+            errors += 1
+            print(f"[session {k}] {e}", file=sys.stderr)
+            writer.write(error_row(args.mode, base, args.model, e, client))
+            return
+        done += 1
+        for row in out:
+            if queue_s is not None:
+                add_queue_wait(row, queue_s)
+            rows.append(row)
+            writer.write(row)
+
+    async def open_loop_one(k, item, send_at):
+        async with inflight:
+            now = time.perf_counter()
+            started.append(now)
+            # trace rows measure this wait themselves, as lateness_ms
+            await one(k, item, None if args.arrival == "trace" else max(0.0, now - send_at))
+
+    async def user():
+        for k, item in next_pair:
+            await one(k, item)
+
+    t0 = time.perf_counter()
+    try:
+        if args.arrival == "closed":
+            await asyncio.gather(*(user() for _ in range(max(1, args.users))))
+        else:
+            tasks = []
+            gap = 1.0 / args.qps
+            send_at = t0 + offset
+            for k, item in next_pair:
+                if args.arrival == "trace":
+                    send_at = t0 + item["t"] / args.speed
+                    item["send_at"] = send_at
+                delay = send_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                scheduled.append(send_at)
+                tasks.append(asyncio.create_task(open_loop_one(k, item, send_at)))
+                send_at += rnd.expovariate(args.qps) if args.arrival == "poisson" else gap
+            await asyncio.gather(*tasks)
+    finally:
+        await client.aclose()
+    pace = None if args.arrival == "closed" else {"offered_qps": rate(scheduled), "started_qps": rate(started)}
+    return rows, done, errors, time.perf_counter() - t0, pace
+
+SUMMARY_KEYS = ("cold_ttft_ms", "warm_ttft_ms", "cold_full_ms", "warm_full_ms",
+                "cold_itl_p99_ms", "warm_itl_p99_ms", "cold_tpot_ms", "warm_tpot_ms",
+                "ttft_ms", "full_ms", "itl_p99_ms", "tpot_ms",
+                "lateness_ms", "sched_ttft_ms", "sched_full_ms",
+                "queue_ms", "cold_sched_ttft_ms", "cold_sched_full_ms")
+
+def count_requests(rows):
+    return sum(2 if "cold_ttft_ms" in r else 1 for r in rows)
+
+def print_summary_header(args, n, errors, elapsed, reqs, pace=None):
+    print(f"=== Load summary ({args.mode}, arrival={args.arrival}) ===")
+    print(f"sessions ok={n} errors={errors} elapsed={elapsed:.2f}s  "
+          f"achieved={n / elapsed if elapsed > 0 else 0:.2f} sessions/s  "
+          f"({reqs / elapsed if elapsed > 0 else 0:.2f} req/s)")
+    if pace and pace["offered_qps"] and pace["started_qps"]:
+        print(f"offered={pace['offered_qps']:.2f} sessions/s  started={pace['started_qps']:.2f} sessions/s")
+    warning = pace_warning(pace, args)
+    if warning:
+        print(warning)
+
+def print_hedge_summary(rows):
+    """
+    Hedge rate, how often the duplicate won, the tokens streamed by cancelled losers, and
+    per kind of request the TTFT tail of the ones that could be hedged next to that of the
+    unhedged probes.
+    """
+    reqs = [dict({k: r.get(p + k) for k in ("hedge_probe", "hedged", "hedge_won", "wasted_tokens", "ttft_ms")},
+                 kind=p[:-1] or "node")
+            for r in rows for p in (("cold_", "warm_") if "cold_ttft_ms" in r else ("",))]
+    reqs = [q for q in reqs if q["hedged"] is not None]
+    if not reqs:
+        return
+    hedged = [q for q in reqs if q["hedged"]]
+    won = sum(1 for q in hedged if q["hedge_won"])
+    wasted = [q["wasted_tokens"] for q in hedged]
+    print(f"hedging: requests={len(reqs)}  hedged={len(hedged)} ({100.0 * len(hedged) / len(reqs):.1f}%)  "
+          f"backup_won={won} ({100.0 * won / len(hedged) if hedged else 0:.1f}% of hedged)  "
+          f"wasted_tokens={'unknown without --stream' if None in wasted else sum(wasted)}")
+    for kind in ("cold", "warm", "node"):
+        ttfts = [q for q in reqs if q["kind"] == kind and q["ttft_ms"] is not None]
+        probes = sorted(q["ttft_ms"] for q in ttfts if q["hedge_probe"])
+        others = sorted(q["ttft_ms"] for q in ttfts if not q["hedge_probe"])
+        if not probes or not others:
+            continue
+        parts = []
+        for q in (50, 99, 99.9):
+            u, h = percentile(probes, q), percentile(others, q)
+            parts.append(f"p{q:g} {u:.1f} -> {h:.1f}ms ({(h - u) / u * 100 if u else 0:+.1f}%)")
+        print(f"hedging {kind} ttft, probes (n={len(probes)}) -> hedgeable (n={len(others)}), negative == faster: "
+              + "  ".join(parts))
+
+def print_load_summary(args, rows, n, errors, elapsed, pace=None):
+    print_summary_header(args, n, errors, elapsed, count_requests(rows), pace)
+    for key in SUMMARY_KEYS:
+        vals = sorted(r[key] for r in rows if r.get(key) is not None)
+        if not vals:
+            continue  # token metrics only exist for --stream runs
+        print(f"{key}: n={len(vals)}  mean={sum(vals) / len(vals):.1f}  "
+              f"p50={percentile(vals, 50):.1f}  p90={percentile(vals, 90):.1f}  "
+              f"p99={percentile(vals, 99):.1f}  max={vals[-1]:.1f}")
+    print_hedge_summary(rows)
+
+# ---------------- Multi-process driver ----------------
+# --workers N runs the load in N processes so request encoding and SSE/JSON decoding
+# are not capped at one core. Item k goes to worker k % N; open-loop rates and
+# closed-loop users are split evenly, and fixed arrivals are phase-shifted so the
+# merged schedule is still evenly spaced. Workers build their clients and warm up,
+# then all start at one wall-clock instant picked by the coordinator. Each worker
+# writes its own result shard (<jsonl>.w<i>, npz chunk-w<i>-*.npz), so no two processes
+# append to one file. The coordinator then lists the JSONL shards in <jsonl>.manifest.json
+# (replaced atomically; analyze_results.py expands --jsonl to its shards) and merges the
+# workers' quantile sketches (analyze_results.LatencySketch) into the summary.
+
+def load_items(args, base):
+    """Returns (items, run_item, prompt_file) for the selected load workload."""
+    pf = None
+    if args.trace:
+        items = read_trace(args.trace)
+        if args.sessions is not None:
+            items = itertools.islice(items, args.sessions)
+        run_item = lambda client, rec: run_trace_request(client, base, args, rec)
+    elif args.tree:
+        items = read_trees(args.tree)
+        if args.sessions is not None:
+            items = itertools.islice(items, args.sessions)
+        run_item = lambda client, nodes: run_tree(client, base, args, nodes)
+    else:
+        pf = PromptFile(args.file)
+        if args.sweep or args.indices:
+            items = parse_indices(args.indices or ":", len(pf))
+            if args.sessions is not None:
+                items = items[:args.sessions]
+        else:
+            # Cycle through the file starting at --index
+            start, n = args.index or 0, len(pf)
+            items = [(start + k) % n for k in range(100 if args.sessions is None else args.sessions)]
+        run_item = lambda client, index: run_one_pair(client, base, args, pf.pair(index))
+    return items, run_item, pf
+
+def worker_args(args, w, n):
+    """Copy of args for worker w of n: its own output files and its share of the load."""
+    a = argparse.Namespace(**vars(args))
+    a.jsonl = f"{args.jsonl}.w{w}" if args.jsonl else ""
+    a.npz_prefix = f"chunk-w{w:02d}-"
+    a.qps = args.qps / n
+    a.users = args.users // n + (w < args.users % n)
+    a.max_inflight = max(1, -(-args.max_inflight // n))
+    a.seed = args.seed + w
+    return a
+
+def load_worker(args, base, w, n, go, start, results):
+    try:
+        from analyze_results import LatencySketch
+        a = worker_args(args, w, n)
+        items, run_item, pf = load_items(a, base)
+
+        async def ready():
+            results.put(("ready", w))
+            await asyncio.get_running_loop().run_in_executor(None, go.wait)
+            await asyncio.sleep(max(0.0, start.value - time.time()))
+
+        offset = w / args.qps if args.arrival == "fixed" else 0.0
+        writer = ResultWriter(a)
+        try:
+            rows, done, errors, elapsed, pace = asyncio.run(run_load(
+                base, a, itertools.islice(items, w, None, n), run_item, writer, ready, offset))
+        finally:
+            if pf:
+                pf.close()
+            writer.close()
+        sketches = {}
+        for key in SUMMARY_KEYS:
+            s = LatencySketch()
+            for r in rows:
+                if r.get(key) is not None:
+                    s.add(r[key])
+            if s.count:
+                sketches[key] = s.to_dict()
+        written = writer.jsonl.written if writer.jsonl else 0  # error rows included
+        results.put(("done", w, done, errors, elapsed, count_requests(rows), sketches, written, pace))
+    except BaseException as e:  # SystemExit included: report instead of hanging the coordinator
+        results.put(("error", w, f"{type(e).__name__}: {e}"))
+
+def write_manifest(jsonl, shard_rows):
+    """Adds this run's shards and row counts to <jsonl>.manifest.json, replacing it atomically."""
+    path = jsonl + ".manifest.json"
+    try:
+        with open(path, encoding="utf-8") as f:
+            shards = {s["path"]: s for s in json.load(f)["shards"]}
+    except (OSError, ValueError, KeyError):
+        shards = {}
+    base = os.path.dirname(path)
+    for shard, rows in sorted(shard_rows.items()):
+        name = os.path.relpath(shard, base or ".")
+        prev = shards.get(name, {}).get("rows", 0)
+        shards[name] = {"path": name, "rows": prev + rows, "bytes": os.path.getsize(shard) if os.path.exists(shard) else 0}
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "updated": round(time.time(), 3), "shards": list(shards.values())}, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def run_workers(args, base):
+    import multiprocessing as mp
+    from analyze_results import LatencySketch
+    n = args.workers
+    if args.arrival == "closed":
+        n = min(n, max(1, args.users))  # every worker needs at least one user
+    ctx = mp.get_context()
+    go, start, results = ctx.Event(), ctx.Value("d", 0.0), ctx.Queue()
+    procs = [ctx.Process(target=load_worker, args=(args, base, w, n, go, start, results), daemon=True)
+             for w in range(n)]
+    for p in procs:
+        p.start()
+
+    def collect(kind, count):
+        out = []
+        while len(out) < count:
+            msg = results.get()
+            if msg[0] == "error":
+                go.set()
+                raise SystemExit(f"[worker {msg[1]}] {msg[2]}")
+            if msg[0] == kind:
+                out.append(msg)
+        return out
+
+    try:
+        collect("ready", n)
+        start.value = time.time() + 0.2  # time for every worker to see the event
+        go.set()
+        done_msgs = collect("done", n)
+    except BaseException:
+        for p in procs:
+            p.terminate()
+        raise
+    for p in procs:
+        p.join()
+
+    if args.jsonl:
+        write_manifest(args.jsonl, {f"{args.jsonl}.w{m[1]}": m[7] for m in done_msgs})
+
+    sketches = {}
+    for msg in done_msgs:
+        for key, d in msg[6].items():
+            s = LatencySketch.from_dict(d)
+            if key in sketches:
+                sketches[key].merge(s)
+            else:
+                sketches[key] = s
+    done = sum(m[2] for m in done_msgs)
+    errors = sum(m[3] for m in done_msgs)
+    elapsed = max(m[4] for m in done_msgs)
+    paces = [m[8] for m in done_msgs]
+    pace = None
+    if all(p and p["offered_qps"] and p["started_qps"] for p in paces):
+        # workers run side by side on a share of the rate each, so their rates add up
+        pace = {k: sum(p[k] for p in paces) for k in ("offered_qps", "started_qps")}
+    print_summary_header(args, done, errors, elapsed, sum(m[5] for m in done_msgs), pace)
+    print(f"workers={n} (quantiles from merged sketches, ~1% relative error)")
+    for key in SUMMARY_KEYS:
+        s = sketches.get(key)
+        if s is None:
+            continue
+        print(f"{key}: n={s.count}  mean={s.mean():.1f}  p50={s.quantile(0.50):.1f}  "
+              f"p90={s.quantile(0.90):.1f}  p99={s.quantile(0.99):.1f}  max={s.max:.1f}")
+
+# ---------------- Capacity search ----------------
+# --capacity finds the highest session rate that still meets the SLOs. Each step runs
+# Poisson arrivals of cold/warm sessions at one rate for --step-seconds and ignores
+# sessions that started in the first --settle-seconds. A step passes when sessions
+# started at the offered rate (within PACE_TOLERANCE), p99 TTFT (cold and warm requests
+# together, cold ones counted from their scheduled arrival so --max-inflight queueing
+# is included) is within --slo-ttft-ms, p99 inter-token latency (all gaps pooled) is
+# within --slo-itl-ms and under 1% of sessions failed. tokens/s is the step's delivered
+# output tokens over its wall time.
+#   step:   rates go --qps-min, x--ramp-factor, ... until a step fails or --qps-max
+#   binary: the same ramp brackets the limit, then --search-steps bisections narrow it
+# Without --mode, lb and gw are searched in turn for every URL given. Both reach the same
+# pods, and a step may wrap around the prompt file, so every session prepends a fresh
+# nonce to its prompts (as --experiment does): a cold call never lands on a prefix cached
+# by an earlier step, session or target.
+
+def capacity_nonce(mode, k, n):
+    return f"[{mode} step {k} session {n} {random.getrandbits(64):016x}] "
+
+def capacity_step(args, base, qps, k):
+    a = argparse.Namespace(**vars(args))
+    a.arrival, a.qps, a.stream = "poisson", qps, True
+    a.sessions = max(1, round(qps * args.step_seconds))
+    a.index = (args.index or 0) + k * a.sessions  # move through the file from step to step
+    a.seed = args.seed + k
+    items, _, pf = load_items(a, base)
+    writer = ResultWriter(a)
+    sessions = itertools.count()
+
+    def run_item(client, index):
+        i, p1, p2, topic = pf.pair(index)
+        nonce = capacity_nonce(args.mode, k, next(sessions))
+        return run_one_pair(client, base, a, (i, nonce + p1, nonce + p2, topic))
+
+    t_start = time.time()
+    try:
+        rows, done, errors, elapsed, pace = asyncio.run(run_load(base, a, items, run_item, writer))
+    finally:
+        if pf:
+            pf.close()
+        writer.close()
+
+    settled = [r for r in rows if (r.get("cold_ts_start") or 0) >= t_start + args.settle_seconds]
+    ttft = sorted(v for r in settled for v in (r.get("cold_sched_ttft_ms", r.get("cold_ttft_ms")), r.get("warm_ttft_ms"))
+                  if v is not None)
+    itl = sorted(us / 1000 for r in settled for k in ("cold_itl_us", "warm_itl_us") for us in r.get(k) or ())
+    tokens = sum((r.get(k) or {}).get("completion_tokens") or 0 for r in rows for k in ("usage_cold", "usage_warm"))
+    pace = pace or {}
+    offered = pace.get("offered_qps") or qps
+    step = {
+        "qps": qps, "offered_qps": offered, "achieved_qps": pace.get("started_qps") or offered,
+        "sessions": done, "errors": errors,
+        "ttft_p99_ms": percentile(ttft, 99), "itl_p99_ms": percentile(itl, 99), "tokens_per_s": tokens / elapsed if elapsed > 0 else 0.0,
     }
+    step["ok"] = (bool(settled) and errors <= 0.01 * max(1, done + errors)
+                  and step["achieved_qps"] >= step["offered_qps"] * (1 - PACE_TOLERANCE)
+                  and step["ttft_p99_ms"] is not None and step["ttft_p99_ms"] <= args.slo_ttft_ms
+                  and (step["itl_p99_ms"] is None or step["itl_p99_ms"] <= args.slo_itl_ms))
+    print(f"[{args.mode}] qps={qps:8.2f}  offered={step['offered_qps']:8.2f}  achieved={step['achieved_qps']:8.2f}  "
+          f"sessions={done} errors={errors}  "
+          f"ttft_p99={step['ttft_p99_ms'] or float('nan'):8.1f}ms  itl_p99={step['itl_p99_ms'] or float('nan'):6.1f}ms  "
+          f"tok/s={step['tokens_per_s']:9.1f}  {'PASS' if step['ok'] else 'FAIL'}", flush=True)
+    return step
+
+def capacity_search(args, base):
+    """Returns (best passing step or None, whether --qps-max was reached without failing)."""
+    steps = []
+
+    def run(qps):
+        steps.append(capacity_step(args, base, qps, len(steps)))
+        return steps[-1]
+
+    best, qps, fail = None, args.qps_min, None
+    while True:
+        step = run(min(qps, args.qps_max))
+        if not step["ok"]:
+            fail = step["qps"]
+            break
+        best = step
+        if step["qps"] >= args.qps_max:
+            return best, True
+        qps *= args.ramp_factor
+    if args.capacity == "binary" and best:
+        lo, hi = best["qps"], fail
+        for _ in range(args.search_steps):
+            mid = (lo * hi) ** 0.5
+            step = run(mid)
+            if step["ok"]:
+                best, lo = step, mid
+            else:
+                hi = mid
+    return best, False
+
+def run_capacity(args, targets):
+    if args.qps_min <= 0 or args.qps_max < args.qps_min or args.ramp_factor <= 1:
+        raise SystemExit("need 0 < --qps-min <= --qps-max and --ramp-factor > 1")
+    if args.settle_seconds >= args.step_seconds:
+        raise SystemExit("--settle-seconds must be shorter than --step-seconds")
+    pods = args.pods or max(1, len(args.metrics_url))
+    results = []
+    for mode, base in targets:
+        args.mode = mode
+        print(f"=== Capacity search ({mode}, {args.capacity}, SLO p99 TTFT <= {args.slo_ttft_ms:g}ms, "
+              f"p99 ITL <= {args.slo_itl_ms:g}ms) ===")
+        best, capped = capacity_search(args, base)
+        results.append((mode, best, capped))
+
+    print(f"=== Capacity ({pods} pods) ===")
+    for mode, best, capped in results:
+        if best is None:
+            print(f"{mode}: SLOs not met even at --qps-min {args.qps_min:g}")
+            continue
+        print(f"{mode}: max sustainable {'>= ' if capped else ''}{best['qps']:.2f} sessions/s "
+              f"({2 * best['qps']:.2f} req/s)  p99 TTFT={best['ttft_p99_ms']:.1f}ms  "
+              f"p99 ITL={best['itl_p99_ms'] or 0:.1f}ms  tokens/s={best['tokens_per_s']:.1f}  "
+              f"per pod={best['tokens_per_s'] / pods:.1f}")
+
+# ---------------- Controlled experiments ----------------
+# --experiment runs every (target, prompt row, --gaps value, repeat) combination as one
+# cold/warm trial, in an order shuffled with --seed so neither target nor prompt order
+# lines up with time. Each trial prepends a fresh nonce to both prompts: the cold call
+# cannot hit a prefix cached by an earlier trial or run, while the warm call still shares
+# the cold call's whole prefix. The warm call waits gap seconds after the cold one
+# finishes; with --background-qps, unrelated one-off requests (nonce'd too) keep the
+# pods' caches churning meanwhile, so warm hit ratio against gap shows how long a cached
+# prefix survives under that load. Without --mode, lb and gw are interleaved.
+
+def parse_gaps(spec):
+    try:
+        gaps = [float(v) for v in spec.split(",") if v.strip()]
+    except ValueError:
+        raise SystemExit(f"--gaps must be a comma-separated list of seconds, got {spec!r}")
+    if not gaps or min(gaps) < 0:
+        raise SystemExit("--gaps values must be >= 0")
+    return gaps
+
+def experiment_trials(targets, indices, gaps, repeats, seed):
+    trials = [(mode, base, index, gap, rep) for mode, base in targets for index in indices
+              for gap in gaps for rep in range(repeats)]
+    random.Random(seed).shuffle(trials)
+    return trials
+
+async def run_experiment_async(args, targets, pf, trials, writer):
+    clients, target_args = {}, {}
+    for mode, base in targets:
+        target_args[mode] = argparse.Namespace(**dict(vars(args), mode=mode))
+        clients[mode] = make_client(base, target_args[mode])
+        await warmup(clients[mode], args)
+    rnd = random.Random(args.seed + 1)
+    rows, errors = [], 0
+    next_trial = iter(enumerate(trials))
+
+    async def one(k, trial):
+        nonlocal errors
+        mode, base, index, gap, rep = trial
+        nonce = f"[trial {k} {rnd.getrandbits(64):016x}] "
+        try:
+            _, p1, p2, topic = pf.pair(index)
+            row = await run_session(clients[mode], base, target_args[mode], (index, nonce + p1, nonce + p2, topic), gap)
+        except Exception as e:
+            errors += 1
+            print(f"[trial {k}] {e}", file=sys.stderr)
+            writer.write(dict(error_row(mode, base, args.model, e, clients[mode]), trial=k, repeat=rep, gap_s=gap))
+            return
+        row.update(trial=k, repeat=rep, gap_s=gap)
+        rows.append(row)
+        writer.write(row)
+
+    async def user():
+        for k, trial in next_trial:
+            await one(k, trial)
+
+    async def background(stop):
+        bg_rnd = random.Random(args.seed + 2)
+        tasks, n = set(), 0
+        while not stop.is_set():
+            await asyncio.sleep(bg_rnd.expovariate(args.background_qps))
+            mode, _ = targets[n % len(targets)]
+            try:
+                _, p1, _, _ = pf.pair(bg_rnd.randrange(len(pf)))
+            except ValueError:
+                continue  # malformed row: skip this background request
+            task = asyncio.create_task(post_once(clients[mode], args.model, f"[bg {n} {bg_rnd.getrandbits(64):016x}] " + p1,
+                                                 args.stream, max_tokens=16))
+            task.add_done_callback(lambda t: (tasks.discard(t), t.cancelled() or t.exception()))
+            tasks.add(task)
+            n += 1
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return n
+
+    stop = asyncio.Event()
+    bg = asyncio.create_task(background(stop)) if args.background_qps > 0 else None
+    t0 = time.perf_counter()
+    try:
+        await asyncio.gather(*(user() for _ in range(max(1, args.users))))
+    finally:
+        stop.set()
+        bg_sent = await bg if bg else 0
+        for client in clients.values():
+            await client.aclose()
+    return rows, errors, bg_sent, time.perf_counter() - t0
+
+def print_experiment_summary(rows, errors, bg_sent, elapsed):
+    print(f"=== Experiment ({len(rows)} trials ok, {errors} errors, {bg_sent} background requests, "
+          f"{elapsed:.1f}s) ===")
+    groups = defaultdict(list)
+    for r in rows:
+        groups[(r["target"], r["gap_s"])].append(r)
+    for (mode, gap), rs in sorted(groups.items()):
+        warm = sorted(r["warm_ttft_ms"] for r in rs)
+        improve = sorted(r["improve_ttft_pct"] for r in rs if r.get("improve_ttft_pct") is not None)
+        hits = [r["warm_cached_tokens"] / r["usage_warm"]["prompt_tokens"] for r in rs
+                if r.get("warm_cached_tokens") is not None and (r.get("usage_warm") or {}).get("prompt_tokens")]
+        same = [r["cold_pod"] == r["warm_pod"] for r in rs if r.get("cold_pod") and r.get("warm_pod")]
+        print(f"{mode} gap={gap:g}s: n={len(rs)}  warm_ttft p50={percentile(warm, 50):.1f}ms  "
+              f"improve_ttft p50={percentile(improve, 50) if improve else float('nan'):.1f}%  "
+              f"warm_cached={sum(hits) / len(hits) * 100 if hits else float('nan'):.1f}%  "
+              f"same_pod={sum(same) / len(same) * 100 if same else float('nan'):.1f}%")
+
+def run_experiment(args, targets):
+    if args.repeats < 1:
+        raise SystemExit("--repeats must be >= 1")
+    if args.background_qps < 0:
+        raise SystemExit("--background-qps must be >= 0")
+    gaps = parse_gaps(args.gaps)
+    pf = PromptFile(args.file)
+    writer = ResultWriter(args)
+    try:
+        indices = parse_indices(args.indices or f"{args.index or 0}:{(args.index or 0) + 10}", len(pf))
+        trials = experiment_trials(targets, indices, gaps, args.repeats, args.seed)
+        print(f"[experiment] {len(trials)} trials: {len(targets)} targets x {len(indices)} prompts x "
+              f"{len(gaps)} gaps x {args.repeats} repeats, {args.users} in flight", file=sys.stderr)
+        rows, errors, bg_sent, elapsed = asyncio.run(run_experiment_async(args, targets, pf, trials, writer))
+    finally:
+        writer.close()
+        pf.close()
+    print_experiment_summary(rows, errors, bg_sent, elapsed)
+
+# ---------------- Server metrics sampler ----------------
+# --metrics-url (repeatable) scrapes vLLM's Prometheus /metrics endpoints on a background
+# thread every --metrics-interval seconds for the whole run. Only the series in
+# METRIC_NAMES are kept, summed over their label sets per pod (the pod="..." label when an
+# endpoint reports several pods, else the URL). --metrics-out is JSONL in two kinds of
+# lines: {"pods": [...], "names": [...]} headers that define the columns, re-emitted
+# whenever a pod or name first appears, and [ts, pod_index, value, ...] samples.
+# analyze_results.py --metrics joins the samples to rows by each request's time window.
+
+METRIC_NAMES = (
+    "vllm:num_requests_running", "vllm:num_requests_waiting",
+    "vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc",                 # v1 / v0 names
+    "vllm:prefix_cache_queries_total", "vllm:prefix_cache_hits_total",
+    "vllm:gpu_prefix_cache_queries_total", "vllm:gpu_prefix_cache_hits_total",
+    "vllm:num_preemptions_total",
+)
+
+def parse_metrics(text, default_pod, names=METRIC_NAMES):
+    """Prometheus text -> {pod: {name: value}} for the wanted names."""
+    out = defaultdict(dict)
+    for line in text.splitlines():
+        if not line.startswith(names):
+            continue
+        head, _, rest = line.partition(" ") if "{" not in line else line.partition("} ")
+        name, _, labels = head.partition("{")
+        if name not in names:
+            continue
+        try:
+            value = float(rest.split()[0])
+        except (IndexError, ValueError):
+            continue
+        pod = default_pod
+        i = labels.find('pod="')
+        if i >= 0:
+            pod = labels[i + 5:labels.index('"', i + 5)]
+        out[pod][name] = out[pod].get(name, 0.0) + value
+    return out
+
+class MetricsSampler:
+    def __init__(self, urls, interval, path, timeout=5.0):
+        import threading
+        urls = [u.rstrip("/") for u in urls]
+        self.urls = [u if u.endswith("/metrics") else u + "/metrics" for u in urls]
+        self.interval = max(0.05, interval)
+        self.timeout = min(timeout, self.interval * 5)
+        self.out = open(path, "a", encoding="utf-8")
+        self.pods, self.names = [], []
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.out.close()
+        print(f"[metrics] {self.samples} samples from {len(self.pods)} pods -> {self.out.name}", file=sys.stderr)
+
+    def _run(self):
+        with httpx.Client(timeout=self.timeout) as http:
+            tick = time.time()
+            while True:
+                self._scrape(http)
+                tick = max(tick + self.interval, time.time())  # fixed rate; skip ticks if a scrape overran
+                if self.stopping.wait(max(0.0, tick - time.time())):
+                    self._scrape(http)  # closing sample so counters cover the end of the run
+                    return
+
+    def _scrape(self, http):
+        for url in self.urls:
+            try:
+                r = http.get(url)
+                r.raise_for_status()
+            except httpx.HTTPError as e:
+                print(f"[metrics] {url}: {e}", file=sys.stderr)
+                continue
+            ts = round(time.time(), 3)
+            for pod, values in parse_metrics(r.text, url).items():
+                self._write(ts, pod, values)
+        self.out.flush()
+
+    def _write(self, ts, pod, values):
+        new_pod = pod not in self.pods
+        new_names = [n for n in values if n not in self.names]
+        if new_pod or new_names:
+            if new_pod:
+                self.pods.append(pod)
+            self.names.extend(new_names)
+            self.out.write(json.dumps({"pods": self.pods, "names": self.names}) + "\n")
+        sample = [ts, self.pods.index(pod)] + [values.get(n) for n in self.names]
+        self.out.write(json.dumps(sample, separators=(",", ":")) + "\n")
+        self.samples += 1
+
+# ---------------- Client self-benchmark ----------------
+# --self-bench replays an SSE stream from memory, with no network involved, and reports
+# how many microseconds the client itself spends per streamed chunk. That bounds how
+# much of a reported TTFT/ITL is harness overhead. The stream is either synthetic
+# (vLLM-shaped, 256 tokens) or a recording: curl -sN <url>/v1/chat/completions ... > x.sse
+
+def synthetic_sse(n_tokens=256):
+    head = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench"}
+
+    def event(obj):
+        return b"data: " + json.dumps(obj, separators=(",", ":")).encode("utf-8") + b"\n\n"
+
+    def delta(d, finish=None):
+        return event({**head, "choices": [{"index": 0, "delta": d, "logprobs": None, "finish_reason": finish}]})
+
+    chunks = [delta({"role": "assistant", "content": ""})]
+    chunks += [delta({"content": f" tok{i}"}) for i in range(n_tokens)]
+    chunks.append(delta({}, "length"))
+    chunks.append(event({**head, "choices": [], "usage": {
+        "prompt_tokens": 1000, "completion_tokens": n_tokens, "total_tokens": 1000 + n_tokens}}))
+    chunks.append(b"data: [DONE]\n\n")
+    return chunks
+
+def read_sse(path):
+    """A recorded stream split into events, each replayed as its own network read."""
+    with open(path, "rb") as f:
+        events = f.read().replace(b"\r\n", b"\n").split(b"\n\n")
+    chunks = [e + b"\n\n" for e in events if e.strip()]
+    if not chunks:
+        raise SystemExit(f"No SSE events in {path}")
+    return chunks
+
+def self_bench(args):
+    chunks = read_sse(args.self_bench) if args.self_bench else synthetic_sse()
+    rounds = max(1, args.self_bench_rounds)
+    n = len(chunks) * rounds
+
+    def scan():
+        s = StreamScan()
+        for c in chunks:
+            s.feed(c, time.perf_counter())
+            if s.done:
+                break
+        return s
+
+    def decode_all():
+        # Reference: what a line-based client does (decode, split, json.loads every chunk)
+        for c in chunks:
+            for line in c.decode("utf-8").splitlines():
+                if line.startswith("data:") and line[5:].strip() != "[DONE]":
+                    has_content(json.loads(line[5:].strip()))
+
+    def us_per_chunk(fn):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return (time.perf_counter() - t0) / n * 1e6
+
+    async def handler(request):
+        async def body():
+            for c in chunks:
+                yield c
+        return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=body())
+
+    async def end_to_end():
+        client = BenchClient("http://127.0.0.1", args.timeout, transport=httpx.MockTransport(handler))
+        try:
+            await post_once(client, "bench", "hi", True)  # first call pays one-time setup
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                await post_once(client, "bench", "hi", True)
+            return (time.perf_counter() - t0) / n * 1e6
+        finally:
+            await client.aclose()
+
+    s = scan()
+    usage = s.final().get("usage")
+    print(f"=== Client self-benchmark ({len(chunks)} chunks x {rounds} rounds, "
+          f"{len(s.token_times)} content chunks, usage {'found' if usage else 'missing'}) ===")
+    print(f"sse scan (raw bytes):         {us_per_chunk(scan):7.2f} us/chunk")
+    print(f"json.loads every chunk:       {us_per_chunk(decode_all):7.2f} us/chunk")
+    e2e = asyncio.run(end_to_end())
+    print(f"post_once via httpx (no net): {e2e:7.2f} us/chunk  "
+          f"({e2e * len(chunks) / 1000:.2f} ms per response)")
+
+def main():
+    ap = argparse.ArgumentParser(description="KV-cache latency demo for llm-d gateway vs loadbalancer.")
+    ap.add_argument("--file", default="prompts.txt", help="Pipe-separated file: prompt1|prompt2|topic")
+    ap.add_argument("--index", type=int, default=None,
+                    help="Prompt row to run (required unless --arrival/--sweep/--indices is set; "
+                         "start row in load mode)")
+    ap.add_argument("--mode", choices=["lb", "gw"], default=None, help="Target to benchmark (required)")
+    ap.add_argument("--lb-url", default=None)
+    ap.add_argument("--gw-url", default=None)
+    ap.add_argument("--model", default="Qwen/Qwen3-0.6B")
+    ap.add_argument("--timeout", type=float, default=90.0)
+    ap.add_argument("--warmup", type=int, default=0)
+    ap.add_argument("--stream", action="store_true", help="Use streaming to measure TTFT")
+    ap.add_argument("--jsonl", default="results.jsonl", help="Append rows here ('' to disable, '-' for stdout)")
+    ap.add_argument("--flush-rows", type=int, default=1000,
+                    help="Write --jsonl rows as soon as this many are waiting (default 1000)")
+    ap.add_argument("--flush-seconds", type=float, default=1.0,
+                    help="... else every this many seconds, also while no rows arrive (default 1)")
+    ap.add_argument("--npz", default=None, help="Also write rows as columnar NumPy chunks into this directory")
+    ap.add_argument("--npz-chunk", type=int, default=10000, help="Rows per --npz chunk (default 10000)")
+    ap.add_argument("--conn", choices=["auto", "pooled", "fresh"], default="auto",
+                    help="pooled: shared keep-alive connections; fresh: new TCP/TLS connection per request; "
+                         "auto (default): fresh for lb (L4 balancing is per connection), pooled for gw")
+    ap.add_argument("--http2", action="store_true", help="Negotiate HTTP/2 on pooled connections (needs h2)")
+    ap.add_argument("--pod-header", action="append", default=[],
+                    help="Response header naming the serving pod, checked before the built-in ones (repeatable)")
+    ap.add_argument("--hedge-after", default=None,
+                    help="Send a duplicate request when no first token arrived after this many ms, or after the "
+                         "pNN of recent TTFTs (e.g. p95); the first to stream wins and the other is cancelled")
+    ap.add_argument("--hedge-url", default=None,
+                    help="Base URL for hedged duplicates (default: the target URL itself)")
+    ap.add_argument("--hedge-probe-every", type=int, default=10,
+                    help="Never hedge a random 1 in N requests (--seed): these probes set the pNN delay of "
+                         "their kind (cold/warm/node) and are the unhedged baseline in the summary "
+                         "(default 10; 0 = no probes, fixed delay only)")
+    # Concurrent load mode
+    ap.add_argument("--arrival", choices=["fixed", "poisson", "closed"], default=None,
+                    help="Run many cold/warm sessions concurrently: fixed/poisson open-loop at --qps, "
+                         "or closed-loop with --users")
+    ap.add_argument("--sessions", type=int, default=None,
+                    help="Sessions to run in load mode (default 100, or one per row with --sweep/--indices)")
+    ap.add_argument("--qps", type=float, default=1.0, help="Session arrival rate for fixed/poisson (default 1)")
+    ap.add_argument("--users", type=int, default=8, help="Concurrent users for closed-loop (default 8)")
+    ap.add_argument("--max-inflight", type=int, default=256,
+                    help="Cap on concurrently running sessions in load mode (default 256)")
+    ap.add_argument("--seed", type=int, default=42, help="Seed for Poisson arrivals")
+    # Sweep mode: many rows in one process
+    ap.add_argument("--sweep", action="store_true", help="Run every prompt pair in --file once")
+    ap.add_argument("--indices", default=None, help="Run the rows START:END (end exclusive) once each")
+    ap.add_argument("--tree", default=None,
+                    help="Replay prefix trees from this JSONL file (make_prompts.py --tree), one session per tree")
+    ap.add_argument("--trace", default=None,
+                    help="Replay a timestamped request trace (JSONL: t, session, messages, max_tokens) open-loop")
+    ap.add_argument("--speed", type=float, default=1.0,
+                    help="Trace replay speed: 2 replays twice as fast, 0.5 at half speed (default 1)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Load mode: drive the load from this many processes (default 1)")
+    # Capacity search
+    ap.add_argument("--capacity", choices=["step", "binary"], default=None,
+                    help="Ramp the session rate until the SLOs break; lb and gw in turn unless --mode is set")
+    ap.add_argument("--slo-ttft-ms", type=float, default=1000.0, help="p99 TTFT target (default 1000)")
+    ap.add_argument("--slo-itl-ms", type=float, default=100.0, help="p99 inter-token latency target (default 100)")
+    ap.add_argument("--qps-min", type=float, default=1.0, help="First rate of the ramp, sessions/s (default 1)")
+    ap.add_argument("--qps-max", type=float, default=256.0, help="Stop ramping here (default 256)")
+    ap.add_argument("--ramp-factor", type=float, default=2.0, help="Rate multiplier between ramp steps (default 2)")
+    ap.add_argument("--search-steps", type=int, default=4, help="Bisections after the ramp with --capacity binary")
+    ap.add_argument("--step-seconds", type=float, default=60.0, help="Duration of each rate step (default 60)")
+    ap.add_argument("--settle-seconds", type=float, default=10.0,
+                    help="Sessions starting this early in a step are not measured (default 10)")
+    ap.add_argument("--pods", type=int, default=None,
+                    help="Pods behind the URL, for tokens/s per pod (default: number of --metrics-url, else 1)")
+    # Controlled cold/warm experiments
+    ap.add_argument("--experiment", action="store_true",
+                    help="Run shuffled, repeated, cache-busted cold/warm trials over --indices (default --index +10 rows) "
+                         "and --gaps; lb and gw interleaved unless --mode is set")
+    ap.add_argument("--repeats", type=int, default=3, help="Trials per target, prompt and gap (default 3)")
+    ap.add_argument("--gaps", default="0.05", help="Comma-separated cold-to-warm gaps in seconds (default 0.05)")
+    ap.add_argument("--background-qps", type=float, default=0.0,
+                    help="Unrelated requests/s sent during --experiment to churn the caches (default 0)")
+    ap.add_argument("--metrics-url", action="append", default=[],
+                    help="Scrape this vLLM /metrics endpoint during the run (repeatable, one per pod)")
+    ap.add_argument("--metrics-interval", type=float, default=1.0, help="Seconds between scrapes (default 1)")
+    ap.add_argument("--metrics-out", default="metrics.jsonl", help="Where --metrics-url samples go")
+    ap.add_argument("--self-bench", nargs="?", const="", default=None, metavar="SSE_FILE",
+                    help="Measure client overhead per streamed chunk on a synthetic or recorded SSE stream, then exit")
+    ap.add_argument("--self-bench-rounds", type=int, default=200, help="Stream replays for --self-bench (default 200)")
+    args = ap.parse_args()
+
+    if args.self_bench is not None:
+        self_bench(args)
+        return
+    if args.flush_seconds <= 0:
+        raise SystemExit("--flush-seconds must be > 0")
+    if args.capacity or args.experiment:
+        modes = [args.mode] if args.mode else [m for m, url in (("lb", args.lb_url), ("gw", args.gw_url)) if url]
+        if not modes:
+            raise SystemExit(f"--{'capacity' if args.capacity else 'experiment'} needs --lb-url and/or --gw-url")
+        targets = [(m, pick_endpoint(m, args.lb_url, args.gw_url)) for m in modes]
+    elif args.mode is None:
+        raise SystemExit("--mode is required")
+    else:
+        base = pick_endpoint(args.mode, args.lb_url, args.gw_url)
+
+    sampler = None
+    if args.metrics_url:
+        sampler = MetricsSampler(args.metrics_url, args.metrics_interval, args.metrics_out, args.timeout)
+        sampler.start()
+    try:
+        if args.capacity:
+            run_capacity(args, targets)
+        elif args.experiment:
+            run_experiment(args, targets)
+        else:
+            run_benchmark(args, base)
+    finally:
+        if sampler:
+            sampler.stop()
+
+def run_benchmark(args, base):
+    if args.trace:
+        if args.speed <= 0:
+            raise SystemExit("--speed must be > 0")
+        args.arrival = "trace"  # the trace's own timestamps replace --arrival/--qps
+    elif args.sweep or args.indices or args.tree:
+        args.arrival = args.arrival or "closed"
+    if args.arrival:
+        if args.arrival != "closed" and args.qps <= 0:
+            raise SystemExit("--qps must be > 0")
+        if args.workers < 1:
+            raise SystemExit("--workers must be >= 1")
+        if args.workers > 1:
+            if args.jsonl == "-":
+                raise SystemExit("--jsonl - cannot be combined with --workers (each worker writes its own shard)")
+            run_workers(args, base)
+            return
+        items, run_item, pf = load_items(args, base)
+        writer = ResultWriter(args)
+        try:
+            rows, done, errors, elapsed, pace = asyncio.run(run_load(base, args, items, run_item, writer))
+        finally:
+            if pf:
+                pf.close()
+            writer.close()
+        print_load_summary(args, rows, done, errors, elapsed, pace)
+        return
+
+    if args.index is None:
+        raise SystemExit("--index is required (or use --arrival, --sweep, --indices or --tree)")
+    p1, p2, topic = read_pair(args.file, args.index)
 
-    print(json.dumps(row, ensure_ascii=False, indent=2))
+    # Cold call, then the warm call (related continuation) on the same client
+    writer = ResultWriter(args)
     try:
-        with open(args.jsonl, "a", encoding="utf-8") as f:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
-    except Exception as e:
-        print(f"[warn] failed to append to {args.jsonl}: {e}", file=sys.stderr)
+        row = asyncio.run(run_single(base, args, (args.index, p1, p2, topic)))
+        if args.jsonl != "-":
+            print(json.dumps(row, ensure_ascii=False, indent=2))
+        writer.write(row)
+    finally:
+        writer.close()
 
 if __name__ == "__main__":
     main()
@@ -10,24 +10,36 @@ prompt1|prompt2|topic
 - prompt1 ≈ 1000 tokens (approx words)
 - prompt2 = prompt1 + ~200 more tokens (same topic, explicit follow-up that references the first part)
 - No '|' characters in any prompt; newlines are collapsed to spaces.
-- Deterministic offline mode by default (no API required).
+- Deterministic offline mode by default (no API required): each row depends only on its
+  row number, so --workers and --start shards produce exactly the bytes of a serial run.
+- Topics beyond the built-in TOPIC_SEEDS are derived procedurally, so --rows can go far past 100.
 - Optional --openai mode to ask an LLM to draft the base content per topic (adds a *relevant* follow-up).
 - Optional --validate to check an existing prompts file.
 
 Usage:
   python3 make_prompts.py --rows 100
+  python3 make_prompts.py --rows 200000 --workers 8 --outfile big.txt
+  python3 make_prompts.py --rows 50000 --start 50000 --outfile shard1.txt
   python3 make_prompts.py --rows 100 --openai --model gpt-4o-mini
+  python3 make_prompts.py --rows 1000 --openai --base-url http://localhost:8000/v1 --model Qwen/Qwen3-0.6B
   python3 make_prompts.py --validate --outfile prompts.txt
+  python3 make_prompts.py --tree --rows 50 --depth 4 --fanout 3 --prefix-tokens 4000
+  python3 make_prompts.py --prefix-sweep 256,1024,4096,16384 --rows 20 --tokenizer meta-llama/Meta-Llama-3.1-8B-Instruct
 """
 
 import argparse
+import asyncio
+import functools
+import hashlib
 import json
+import os
 import random
 import re
 import sys
 from collections import Counter
+from multiprocessing import Pool
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterable, List, Optional, Tuple
 
 # ---------------- Config ----------------
 DEFAULT_ROWS = 100
@@ -78,6 +90,30 @@ TOPIC_SEEDS = [
 ]
 assert len(TOPIC_SEEDS) >= DEFAULT_ROWS, "Need at least 100 topics in TOPIC_SEEDS."
 
+# Rows past len(TOPIC_SEEDS) reuse a seed topic with a qualifier (and a cycle number once
+# the qualifiers run out), which keeps every topic unique for any number of rows.
+TOPIC_QUALIFIERS = [
+    "for regulated industries", "at planet scale", "on a shoestring budget", "for small teams",
+    "in hybrid cloud", "at the edge", "under strict latency SLOs", "with legacy systems",
+    "for emerging markets", "during peak season", "with privacy constraints", "after an acquisition",
+    "for public sector", "in multi-tenant platforms", "with GPU scarcity", "across time zones",
+]
+
+def topic_for(row: int) -> str:
+    """Deterministic, unique topic for a 0-based row number."""
+    seed = TOPIC_SEEDS[row % len(TOPIC_SEEDS)]
+    variant = row // len(TOPIC_SEEDS)
+    if variant == 0:
+        return seed
+    q = TOPIC_QUALIFIERS[(variant - 1) % len(TOPIC_QUALIFIERS)]
+    cycle = (variant - 1) // len(TOPIC_QUALIFIERS)
+    return f"{seed} {q}" + (f" cycle {cycle + 1}" if cycle else "")
+
+def stable_seed(text: str) -> int:
+    """RNG seed from text that, unlike hash(), does not change with PYTHONHASHSEED."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") ^ RNG_SEED
+
 
 # ---------------- Utilities ----------------
 
@@ -113,34 +149,32 @@ def clamp_to_target(text: str, target_tokens: int) -> str:
 
 # ---------------- Offline text synthesis (improved structure) ----------------
 
+SYNONYMS = [
+    "system", "architecture", "throughput", "latency", "scalability", "robustness",
+    "workflow", "pipeline", "dataset", "feature", "metric", "baseline", "benchmark",
+    "evaluation", "validation", "safety", "privacy", "compliance", "monitoring",
+    "governance", "orchestration", "deployment", "capacity", "efficiency",
+    "accuracy", "recall", "precision", "tradeoff", "cache", "vector", "index",
+    "sharding", "replication", "failover", "queue", "batch", "realtime", "stream",
+    "signal", "label", "context", "token", "prefix", "inference", "serving",
+    "autoscale", "scheduling", "optimizer", "regularization", "ranking",
+    "retrieval", "approximate", "hashing", "checkpoint", "drift", "monitor",
+    "explainability", "cohort", "segmentation", "embedding", "router", "gateway",
+    "loadbalancer", "affinity", "consistency", "isolation", "durability",
+    "observability", "profiling", "telemetry", "slo", "sla", "backpressure",
+    "throughput", "failover", "canary", "bluegreen", "rollout", "rollback"
+]
+
 def build_word_bank(topic: str) -> List[str]:
-    """Make a deterministic, topic-biased pseudo-corpus without external APIs."""
+    """Topic-biased vocabulary without external APIs (words are drawn uniformly from it)."""
     base = re.sub(r"[^a-z0-9 ]+", " ", topic.lower())
-    base_words = [w for w in base.split() if w]
-    synonyms = [
-        "system", "architecture", "throughput", "latency", "scalability", "robustness",
-        "workflow", "pipeline", "dataset", "feature", "metric", "baseline", "benchmark",
-        "evaluation", "validation", "safety", "privacy", "compliance", "monitoring",
-        "governance", "orchestration", "deployment", "capacity", "efficiency",
-        "accuracy", "recall", "precision", "tradeoff", "cache", "vector", "index",
-        "sharding", "replication", "failover", "queue", "batch", "realtime", "stream",
-        "signal", "label", "context", "token", "prefix", "inference", "serving",
-        "autoscale", "scheduling", "optimizer", "regularization", "ranking",
-        "retrieval", "approximate", "hashing", "checkpoint", "drift", "monitor",
-        "explainability", "cohort", "segmentation", "embedding", "router", "gateway",
-        "loadbalancer", "affinity", "consistency", "isolation", "durability",
-        "observability", "profiling", "telemetry", "slo", "sla", "backpressure",
-        "throughput", "failover", "canary", "bluegreen", "rollout", "rollback"
-    ]
-    bank = (base_words + synonyms) * 50
-    random.shuffle(bank)
-    return bank
+    return [w for w in base.split() if w] + SYNONYMS
 
 def synth_sentence(rnd: random.Random, bank: List[str], topic: str, min_len=14, max_len=26) -> str:
     sent_len = rnd.randint(min_len, max_len)
-    words = [bank[rnd.randrange(len(bank))] for _ in range(max(4, sent_len - 8))]
+    words = rnd.choices(bank, k=max(4, sent_len - 8))
     # Add some topic words to keep on-theme
-    words += [w for w in topic.lower().split()[:4]]
+    words += topic.lower().split()[:4]
     rnd.shuffle(words)
     return (" ".join(words)).capitalize() + "."
 
@@ -155,7 +189,7 @@ def synth_base_context(target_tokens: int, topic: str) -> str:
     More structured ~1000-token passage with soft sections to improve coherence.
     """
     bank = build_word_bank(topic)
-    rnd = random.Random(hash(topic + "|base") ^ RNG_SEED)
+    rnd = random.Random(stable_seed(topic + "|base"))
     sections = [
         ("Overview", 5),
         ("Constraints", 4),
@@ -182,7 +216,6 @@ def synth_followup_extra(base_text: str, topic: str, target_tokens: int) -> str:
     Generate a ~200-token follow-up that *explicitly* refers to the preceding passage.
     We craft a short interrogative/task block referencing salient keywords.
     """
-    rnd = random.Random(hash(topic + "|extra") ^ RNG_SEED)
     kws = take_top_keywords(base_text, topic, k=12)
     # Build a compact set of questions + a small task prompt
     prompts = [
@@ -212,13 +245,304 @@ def make_pair(topic: str) -> Tuple[str, str, str]:
     p2 = sanitize_line(p1 + " " + extra)
     return p1, p2, sanitize_line(topic)
 
-def write_rows(rows: List[Tuple[str, str, str]], out_path: Path):
-    out_path.write_text("", encoding="utf-8")  # truncate
-    with out_path.open("a", encoding="utf-8") as f:
-        for p1, p2, topic in rows:
-            # pipe-delimited: prompt1|prompt2|topic
-            line = f"{p1}{DELIM}{p2}{DELIM}{topic}\n"
+def format_row(p1: str, p2: str, topic: str) -> str:
+    # pipe-delimited: prompt1|prompt2|topic
+    return f"{p1}{DELIM}{p2}{DELIM}{topic}\n"
+
+def offline_line(row: int) -> str:
+    """One output line for a row number; a pure function of row, so it can run in any process."""
+    return format_row(*make_pair(topic_for(row)))
+
+def write_lines(lines: Iterable[str], out_path: Path) -> int:
+    """Streams lines to out_path (truncating it) as they are produced; returns the count."""
+    n = 0
+    with out_path.open("w", encoding="utf-8") as f:
+        for line in lines:
             f.write(line)
+            n += 1
+    return n
+
+def generate_offline(start: int, rows: int, workers: int, make_line=offline_line) -> Iterable[str]:
+    """Yields make_line(row) for rows [start, start+rows) in order, fanned out over a process pool."""
+    row_ids = range(start, start + rows)
+    if workers <= 1:
+        yield from map(make_line, row_ids)
+        return
+    with Pool(workers) as pool:
+        yield from pool.imap(make_line, row_ids, chunksize=max(1, min(64, rows // (workers * 4))))
+
+# ---------------- Prefix-tree workloads ----------------
+# --tree writes JSONL prefix trees instead of pairs, one line per request node:
+#   {"tree": 0, "node": 2, "parent": 0, "depth": 1, "topic": "...", "messages": [...]}
+# The root holds a long system prompt (--prefix-tokens) shared by the whole tree plus the
+# first user turn (--suffix-tokens). Every child continues its parent's conversation with
+# one assistant reply and one new user turn, each node has --fanout children, and trees
+# are --depth turns deep. Nodes are listed breadth-first and store only their own messages;
+# a replay sends the ancestors' messages followed by the node's.
+
+def synth_turn(topic: str, key: str, target_tokens: int) -> str:
+    """Deterministic filler text of exactly target_tokens words for one conversation turn."""
+    bank = build_word_bank(topic)
+    rnd = random.Random(stable_seed(f"{topic}|{key}"))
+    words: List[str] = []
+    while len(words) < target_tokens:
+        words.extend(synth_sentence(rnd, bank, topic).split())
+    return sanitize_line(" ".join(words[:target_tokens]))
+
+def tree_lines(tree: int, depth: int, fanout: int, prefix_tokens: int, suffix_tokens: int) -> str:
+    """All node lines of one prefix tree; a pure function of its arguments like offline_line."""
+    topic = topic_for(tree)
+    system = clamp_to_target(synth_base_context(prefix_tokens, topic), prefix_tokens)
+    reply_tokens = max(16, suffix_tokens // 2)
+    out = []
+    level = [(0, None)]  # (node id, parent id) of the current depth
+    next_id = 1
+    for d in range(max(1, depth)):
+        children = []
+        for node, parent in level:
+            question = {"role": "user", "content": synth_turn(topic, f"{node}|user", suffix_tokens)}
+            if parent is None:
+                messages = [{"role": "system", "content": system}, question]
+            else:
+                reply = {"role": "assistant", "content": synth_turn(topic, f"{node}|assistant", reply_tokens)}
+                messages = [reply, question]
+            out.append(json.dumps({"tree": tree, "node": node, "parent": parent, "depth": d,
+                                   "topic": sanitize_line(topic), "messages": messages}) + "\n")
+            for _ in range(fanout):
+                children.append((next_id, node))
+                next_id += 1
+        level = children
+    return "".join(out)
+
+# ---------------- LLM-assisted authoring (--openai) ----------------
+# Topics are fetched concurrently (at most --concurrency requests in flight) and every
+# successful answer is stored in a content-addressed cache keyed by (topic, model, system
+# prompt), so reruns only pay for what changed. Failed topics fall back to offline text
+# and are reported, never cached.
+
+SYS_PROMPT = (
+    "You draft long contextual passages for latency benchmarking.\n"
+    "- Produce a single-paragraph base context (~1000 tokens) for the supplied topic.\n"
+    "- Then produce a follow-up (~200 tokens) that explicitly references the base and asks probing questions/tasks.\n"
+    "- Avoid the '|' character entirely. Avoid markdown. Return JSON with keys: base, extra.\n"
+)
+
+def cache_key(topic: str, model: str, sys_prompt: str) -> str:
+    return hashlib.sha256(json.dumps([topic, model, sys_prompt]).encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """One JSON file per answer under directory/<key[:2]>/<key>.json."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self._path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, obj: dict):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(obj), encoding="utf-8")
+        tmp.replace(path)  # concurrent readers never see a partial file
+
+async def fetch_from_llm(client, model: str, topic: str) -> dict:
+    user_prompt = f"Topic: {topic}\nReturn JSON only."
+    resp = await client.chat.completions.create(
+        model=model,
+        temperature=0.6,
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": SYS_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+        max_tokens=2200,
+    )
+    obj = json.loads(resp.choices[0].message.content)
+    if not isinstance(obj, dict) or not obj.get("base"):
+        raise ValueError("response JSON has no 'base'")
+    return obj
+
+def llm_pair(topic: str, obj: dict) -> Tuple[str, str]:
+    base = sanitize_line(obj.get("base", ""))
+    extra = sanitize_line(obj.get("extra", ""))
+    # Clamp lengths if the model overshoots/undershoots
+    if token_len(base) < TARGET_TOKENS_P1:
+        # pad with offline to hit target deterministically
+        pad = synth_base_context(TARGET_TOKENS_P1 - token_len(base), topic)
+        base = sanitize_line((base + " " + pad).strip())
+    extra = clamp_to_target(extra, TARGET_TOKENS_P2_EXTRA)
+    return base, extra
+
+async def write_llm_rows(client, topics: List[str], model: str, cache: Optional[LLMCache],
+                         concurrency: int, out_path: Path) -> dict:
+    """Authors one row per topic and streams them to out_path in topic order; returns counts."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+    stats = {"fetched": 0, "cached": 0, "fallback": 0}
+
+    async def author(topic: str) -> str:
+        key = cache_key(topic, model, SYS_PROMPT)
+        obj = cache.get(key) if cache else None
+        if obj is not None:
+            stats["cached"] += 1
+        else:
+            try:
+                async with sem:
+                    obj = await fetch_from_llm(client, model, topic)
+                stats["fetched"] += 1
+                if cache:
+                    cache.put(key, obj)
+            except Exception as e:
+                # Fallback to offline if API fails
+                stats["fallback"] += 1
+                print(f"[fallback] {topic}: {type(e).__name__}: {e}", file=sys.stderr)
+        if obj is None:
+            base = synth_base_context(TARGET_TOKENS_P1, topic)
+            extra = synth_followup_extra(base, topic, TARGET_TOKENS_P2_EXTRA)
+        else:
+            base, extra = llm_pair(topic, obj)
+        return format_row(sanitize_line(base), sanitize_line(base + " " + extra), sanitize_line(topic))
+
+    tasks = [asyncio.create_task(author(t)) for t in topics]
+    with out_path.open("w", encoding="utf-8") as f:
+        for task in tasks:
+            f.write(await task)
+    return stats
+
+# ---------------- Prefix-length sweep ----------------
+# --prefix-sweep L1,L2,... writes --rows pairs per length in the usual prompt1|prompt2|topic
+# format, with prompt1 exactly L tokens and prompt2 = prompt1 + a question that makes it
+# exactly --suffix-tokens tokens longer, both counted with a local Hugging Face tokenizer (--tokenizer,
+# the served model's). The topic field starts with "prefix=L" for
+# analyze_results.py --prefix-curve. Lengths are interleaved row by row so a --sweep run
+# does not take all short prompts first.
+#
+# Exact lengths come from cutting a longer filler at token L and re-encoding the cut text,
+# retrying when decode/encode does not round-trip. The question is cut in context, after
+# prompt1 and a space, so tokens merging across the boundary are counted as they are sent. Every step tokenizes the whole batch in
+# one call, and finished texts are cached per (tokenizer, topic, length) in --cache-dir,
+# so reruns and longer sweeps do not tokenize the same text twice.
+
+def parse_lengths(spec: str) -> List[int]:
+    try:
+        lengths = [int(v) for v in spec.split(",") if v.strip()]
+    except ValueError:
+        raise SystemExit(f"--prefix-sweep must be a comma-separated list of token counts, got {spec!r}")
+    if not lengths or min(lengths) < 1:
+        raise SystemExit("--prefix-sweep lengths must be >= 1")
+    return lengths
+
+def load_tokenizer(name: str):
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        print("--prefix-sweep needs a local tokenizer: pip install transformers", file=sys.stderr)
+        sys.exit(1)
+    return AutoTokenizer.from_pretrained(name)
+
+class ExactTokenizer:
+    """Cuts texts to exact token counts with batched tokenizer calls and an on-disk cache."""
+
+    def __init__(self, name: str, cache: Optional[LLMCache]):
+        self.name = name
+        self.cache = cache
+        self._tok = None
+        self.stats = {"tokenized": 0, "cached": 0, "inexact": 0}
+
+    @property
+    def tok(self):
+        if self._tok is None:
+            self._tok = load_tokenizer(self.name)
+        return self._tok
+
+    def encode(self, texts: List[str]) -> List[List[int]]:
+        return self.tok(texts, add_special_tokens=False)["input_ids"] if texts else []
+
+    def cut(self, jobs: List[Tuple[str, str, int]], contexts: Optional[List[str]] = None) -> List[str]:
+        """
+        jobs are (topic, key, tokens); returns for each a text of exactly that many tokens.
+        With contexts, each text is counted where it is used, after its context and a space:
+        context + " " + text is exactly that many tokens longer than the context alone.
+        """
+        contexts = contexts or [""] * len(jobs)
+        keys = [hashlib.sha256(json.dumps(["tokens", self.name, t, k, n, c]).encode("utf-8")).hexdigest()
+                for (t, k, n), c in zip(jobs, contexts)]
+        out: List[Optional[str]] = [None] * len(jobs)
+        if self.cache:
+            for i, key in enumerate(keys):
+                obj = self.cache.get(key)
+                if obj is not None:
+                    out[i] = obj["text"]
+        todo = [i for i, text in enumerate(out) if text is None]
+        self.stats["cached"] += len(jobs) - len(todo)
+
+        # Context tokens come first in the encoding; the target is that many plus the job's
+        lead = {i: contexts[i] + " " if contexts[i] else "" for i in todo}
+        with_context = [i for i in todo if contexts[i]]
+        base = dict.fromkeys(todo, 0)
+        base.update(zip(with_context, map(len, self.encode([contexts[i] for i in with_context]))))
+        target = {i: base[i] + jobs[i][2] for i in todo}
+
+        # Filler long enough to hold the target: words are at least one token each, but
+        # grow it until the batch encode confirms it
+        words = {i: jobs[i][2] for i in todo}
+        ids = {}
+        while words:
+            batch = list(words)
+            fillers = [lead[i] + synth_turn(jobs[i][0], jobs[i][1], words[i]) for i in batch]
+            for i, enc in zip(batch, self.encode(fillers)):
+                if len(enc) >= target[i]:
+                    ids[i] = enc
+                    del words[i]
+                else:
+                    words[i] = words[i] * 2
+        # Cut at the target token and re-encode behind the context; shift the cut until
+        # it round-trips
+        cut = dict(target)
+        pending = list(todo)
+        for _ in range(8):
+            if not pending:
+                break
+            texts = [sanitize_line(t) for t in self.tok.batch_decode([ids[i][base[i]:cut[i]] for i in pending])]
+            retry = []
+            for i, text, enc in zip(pending, texts, self.encode([lead[i] + t for i, t in zip(pending, texts)])):
+                out[i] = text
+                if len(enc) != target[i] and base[i] < cut[i] + target[i] - len(enc) <= len(ids[i]):
+                    cut[i] += target[i] - len(enc)
+                    retry.append(i)
+            pending = retry
+        self.stats["inexact"] += len(pending)
+        self.stats["tokenized"] += len(todo)
+        if self.cache:
+            for i in todo:
+                self.cache.put(keys[i], {"text": out[i], "tokens": jobs[i][2]})
+        return out
+
+def sweep_jobs(lengths: List[int], start: int, rows: int) -> List[Tuple[int, int]]:
+    """(row number, length) for every pair, lengths interleaved row by row."""
+    return [(start + r * len(lengths) + j, length) for r in range(rows) for j, length in enumerate(lengths)]
+
+def write_sweep(tokenizer: ExactTokenizer, lengths: List[int], start: int, rows: int,
+                suffix_tokens: int, out_path: Path, batch: int = 256) -> int:
+    """Writes the sweep rows to out_path in batches of pairs; returns the row count."""
+    jobs = sweep_jobs(lengths, start, rows)
+    n = 0
+    with out_path.open("w", encoding="utf-8") as f:
+        for k in range(0, len(jobs), batch):
+            chunk = jobs[k:k + batch]
+            topics = [topic_for(row) for row, _ in chunk]
+            prefixes = tokenizer.cut([(t, f"prefix|{length}", length) for t, (_, length) in zip(topics, chunk)])
+            suffixes = tokenizer.cut([(t, "suffix", suffix_tokens) for t in topics], contexts=prefixes)
+            for topic, (_, length), p1, extra in zip(topics, chunk, prefixes, suffixes):
+                f.write(format_row(p1, f"{p1} {extra}", f"prefix={length} {sanitize_line(topic)}"))
+                n += 1
+    return n
 
 # ---------------- Validation ----------------
 
@@ -231,30 +555,31 @@ def validate_file(path: Path) -> int:
     Returns number of issues found.
     """
     issues = 0
-    lines = path.read_text(encoding="utf-8").splitlines()
-    for i, line in enumerate(lines):
-        parts = line.split(DELIM)
-        if len(parts) != 3:
-            print(f"[L{i}] wrong number of fields: {len(parts)}")
-            issues += 1
-            continue
-        p1, p2, topic = parts
-        # 1) Ensure p2 has p1 as prefix
-        if not p2.startswith(p1 + " "):
-            print(f"[L{i}] prompt2 is not prefix-extended from prompt1")
-            issues += 1
-        # 2) Check approximate lengths
-        n1, n2 = token_len(p1), token_len(p2) - token_len(p1)
-        if abs(n1 - TARGET_TOKENS_P1) > 150:
-            print(f"[L{i}] prompt1 token count off: got {n1}")
-            issues += 1
-        if abs(n2 - TARGET_TOKENS_P2_EXTRA) > 80:
-            print(f"[L{i}] extra token count off: got {n2}")
-            issues += 1
-        # 3) Check stray pipes inside fields (shouldn't happen after sanitize)
-        if (DELIM in p1) or (DELIM in p2) or (DELIM in topic):
-            print(f"[L{i}] stray delimiter detected in fields")
-            issues += 1
+    with path.open(encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            parts = line.rstrip("\n").split(DELIM)
+            if len(parts) != 3:
+                print(f"[L{i}] wrong number of fields: {len(parts)}")
+                issues += 1
+                continue
+            p1, p2, topic = parts
+            # 1) Ensure p2 has p1 as prefix
+            if not p2.startswith(p1 + " "):
+                print(f"[L{i}] prompt2 is not prefix-extended from prompt1")
+                issues += 1
+            # 2) Check approximate lengths (--prefix-sweep rows have their own, exact ones)
+            n1, n2 = token_len(p1), token_len(p2) - token_len(p1)
+            sweep = topic.startswith("prefix=")
+            if not sweep and abs(n1 - TARGET_TOKENS_P1) > 150:
+                print(f"[L{i}] prompt1 token count off: got {n1}")
+                issues += 1
+            if not sweep and abs(n2 - TARGET_TOKENS_P2_EXTRA) > 80:
+                print(f"[L{i}] extra token count off: got {n2}")
+                issues += 1
+            # 3) Check stray pipes inside fields (shouldn't happen after sanitize)
+            if (DELIM in p1) or (DELIM in p2) or (DELIM in topic):
+                print(f"[L{i}] stray delimiter detected in fields")
+                issues += 1
     print(f"Validation complete. Issues found: {issues}")
     return issues
 
@@ -263,12 +588,37 @@ def validate_file(path: Path) -> int:
 def main():
     parser = argparse.ArgumentParser(description="Generate long prompt pairs for KV/prefix caching benchmarks.")
     parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="number of rows to generate (default 100)")
-    parser.add_argument("--outfile", type=str, default=str(PROMPTS_PATH), help="output file (default prompts.txt)")
+    parser.add_argument("--outfile", type=str, default=None,
+                        help="output file (default prompts.txt, or prompts_tree.jsonl with --tree)")
     parser.add_argument("--openai", action="store_true",
                         help="Use OpenAI to author base text per topic (optional, requires OPENAI_API_KEY).")
     parser.add_argument("--model", type=str, default="gpt-4o-mini", help="OpenAI model for --openai mode")
+    parser.add_argument("--base-url", type=str, default=None,
+                        help="OpenAI-compatible endpoint for --openai mode (e.g. http://localhost:8000/v1)")
+    parser.add_argument("--concurrency", type=int, default=16, help="--openai: requests in flight (default 16)")
+    parser.add_argument("--cache-dir", type=str, default=".llm_cache",
+                        help="--openai answers and --prefix-sweep texts are cached here ('' to disable, default .llm_cache)")
     parser.add_argument("--validate", action="store_true", help="Validate an existing prompts file and exit")
+    parser.add_argument("--start", type=int, default=0,
+                        help="first row number (for sharding: shards concatenate to a serial run)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes for offline generation (default: all cores)")
+    parser.add_argument("--tree", action="store_true",
+                        help="write --rows prefix trees (multi-turn chains with fan-out) as JSONL instead of pairs")
+    parser.add_argument("--depth", type=int, default=3, help="--tree: turns per conversation (default 3)")
+    parser.add_argument("--fanout", type=int, default=2, help="--tree: children per node (default 2)")
+    parser.add_argument("--prefix-tokens", type=int, default=TARGET_TOKENS_P1,
+                        help="--tree: shared system prompt length in tokens (default 1000)")
+    parser.add_argument("--suffix-tokens", type=int, default=TARGET_TOKENS_P2_EXTRA,
+                        help="--tree: tokens added per user turn; --prefix-sweep: exact follow-up length (default 200)")
+    parser.add_argument("--prefix-sweep", type=str, default=None, metavar="L1,L2,...",
+                        help="write --rows pairs per shared-prefix length, in exact tokens of --tokenizer")
+    parser.add_argument("--tokenizer", type=str, default=None,
+                        help="--prefix-sweep: Hugging Face tokenizer name or local path (use the served model's)")
     args = parser.parse_args()
+    if args.outfile is None:
+        args.outfile = ("prompts_tree.jsonl" if args.tree else
+                        "prompts_sweep.txt" if args.prefix_sweep else str(PROMPTS_PATH))
 
     if args.validate:
         path = Path(args.outfile)
@@ -278,73 +628,53 @@ def main():
         issues = validate_file(path)
         sys.exit(0 if issues == 0 else 3)
 
-    random.seed(RNG_SEED)
+    # ---- Prefix trees (offline) ----
+    if args.tree:
+        make_tree = functools.partial(tree_lines, depth=args.depth, fanout=args.fanout,
+                                      prefix_tokens=args.prefix_tokens, suffix_tokens=args.suffix_tokens)
+        n = write_lines(generate_offline(args.start, args.rows, args.workers, make_tree), Path(args.outfile))
+        print(f"✅ Wrote {n} trees to {args.outfile} (JSONL, depth={args.depth}, fanout={args.fanout}).")
+        return
 
-    topics = TOPIC_SEEDS[:args.rows]
-    rows: List[Tuple[str, str, str]] = []
+    # ---- Prefix-length sweep (exact token counts) ----
+    if args.prefix_sweep:
+        if not args.tokenizer:
+            parser.error("--prefix-sweep needs --tokenizer")
+        lengths = parse_lengths(args.prefix_sweep)
+        tokenizer = ExactTokenizer(args.tokenizer, LLMCache(Path(args.cache_dir)) if args.cache_dir else None)
+        n = write_sweep(tokenizer, lengths, args.start, args.rows, args.suffix_tokens, Path(args.outfile))
+        st = tokenizer.stats
+        print(f"✅ Wrote {n} rows to {args.outfile} ({args.rows} per prefix length, {len(lengths)} lengths; "
+              f"{st['tokenized']} texts tokenized, {st['cached']} cached).")
+        if st["inexact"]:
+            print(f"[warn] {st['inexact']} texts did not round-trip to their exact token count", file=sys.stderr)
+        return
 
     # ---- Offline deterministic generation (default) ----
     if not args.openai:
-        for topic in topics:
-            p1, p2, t = make_pair(topic)
-            rows.append((p1, p2, t))
-        write_rows(rows, Path(args.outfile))
-        print(f"✅ Wrote {len(rows)} rows to {args.outfile} (pipe-delimited, offline).")
+        n = write_lines(generate_offline(args.start, args.rows, args.workers), Path(args.outfile))
+        print(f"✅ Wrote {n} rows to {args.outfile} (pipe-delimited, offline).")
         return
 
+    topics = [topic_for(i) for i in range(args.start, args.start + args.rows)]
+
     # ---- Optional OpenAI mode (adds coherent base + targeted follow-up) ----
     try:
-        from openai import OpenAI
+        from openai import AsyncOpenAI
     except Exception as e:
         print("OpenAI SDK not installed. Run: pip install openai", file=sys.stderr)
         sys.exit(1)
 
-    client = OpenAI()  # reads OPENAI_API_KEY
-    sys_prompt = (
-        "You draft long contextual passages for latency benchmarking.\n"
-        "- Produce a single-paragraph base context (~1000 tokens) for the supplied topic.\n"
-        "- Then produce a follow-up (~200 tokens) that explicitly references the base and asks probing questions/tasks.\n"
-        "- Avoid the '|' character entirely. Avoid markdown. Return JSON with keys: base, extra.\n"
-    )
-
-    def fetch_from_llm(topic: str) -> Tuple[str, str]:
-        user_prompt = f"Topic: {topic}\nReturn JSON only."
-        resp = client.chat.completions.create(
-            model=args.model,
-            temperature=0.6,
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            max_tokens=2200,
-        )
-        content = resp.choices[0].message.content
-        obj = json.loads(content)
-        base = sanitize_line(obj.get("base", ""))
-        extra = sanitize_line(obj.get("extra", ""))
-        # Clamp lengths if the model overshoots/undershoots
-        if token_len(base) < TARGET_TOKENS_P1:
-            # pad with offline to hit target deterministically
-            pad = synth_base_context(TARGET_TOKENS_P1 - token_len(base), topic)
-            base = sanitize_line((base + " " + pad).strip())
-        extra = clamp_to_target(extra, TARGET_TOKENS_P2_EXTRA)
-        return base, extra
-
-    for topic in topics:
-        try:
-            base, extra = fetch_from_llm(topic)
-        except Exception:
-            # Fallback to offline if API fails
-            base = synth_base_context(TARGET_TOKENS_P1, topic)
-            extra = synth_followup_extra(base, topic, TARGET_TOKENS_P2_EXTRA)
-        p1 = sanitize_line(base)
-        p2 = sanitize_line(base + " " + extra)
-        rows.append((p1, p2, sanitize_line(topic)))
-
-    write_rows(rows, Path(args.outfile))
-    print(f"✅ Wrote {len(rows)} rows to {args.outfile} (pipe-delimited, OpenAI-assisted).")
-
+    # reads OPENAI_API_KEY; local OpenAI-compatible stand-ins usually accept any key
+    api_key = os.environ.get("OPENAI_API_KEY") or ("EMPTY" if args.base_url else None)
+    client = AsyncOpenAI(base_url=args.base_url, api_key=api_key)
+    cache = LLMCache(Path(args.cache_dir)) if args.cache_dir else None
+    stats = asyncio.run(write_llm_rows(client, topics, args.model, cache, args.concurrency, Path(args.outfile)))
+    print(f"✅ Wrote {args.rows} rows to {args.outfile} (pipe-delimited, OpenAI-assisted: "
+          f"{stats['fetched']} fetched, {stats['cached']} cached, {stats['fallback']} offline fallbacks).")
+    if stats["fallback"]:
+        print(f"[warn] {stats['fallback']} topics used offline text; rerun to retry them "
+              f"(successful answers are cached)", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# sim_server.py — local stand-in for a multi-pod vLLM deployment, for running
+# kv_latency_demo.py / analyze_results.py without a GPU cluster.
+#
+# Simulates N pods sharing one model. Each pod keeps an LRU prefix KV cache of
+# --kv-tokens tokens (vLLM-style hashed blocks of --block-size tokens), serves at most
+# --max-num-seqs requests at a time and charges a prefill cost per *uncached* prompt
+# token plus a decode cost per output token. Two OpenAI-compatible listeners front
+# the same pods:
+#
+#   --lb-port  round-robin (or random), like the Service LoadBalancer
+#   --gw-port  prefix-affinity, like the Inference Gateway: longest cached prefix wins,
+#              least-loaded pod on ties or when the best pod's queue is too deep
+#
+# Endpoints (both ports): POST /v1/chat/completions (JSON or SSE with stream=true),
+# GET /v1/models, GET /health, GET /metrics (all pods, pod label) and
+# GET /pods/<i>/metrics (one pod) in vLLM's Prometheus metric names.
+# Tokens are whitespace-separated words, matching make_prompts.py's approximation.
+#
+# Usage:
+#   python3 sim_server.py --pods 4 --kv-tokens 20000
+#   python3 kv_latency_demo.py --mode lb --lb-url http://127.0.0.1:8001 --stream --sweep
+#   python3 kv_latency_demo.py --mode gw --gw-url http://127.0.0.1:8002 --stream --sweep
+#   python3 sim_server.py --time-scale 0     # no simulated delays: benchmark the client itself
+
+import argparse, asyncio, json, random, sys, time
+from collections import OrderedDict
+from itertools import count
+
+# ---------------- Pods ----------------
+
+class PrefixCache:
+    """LRU set of prompt block hashes; block i's hash chains all tokens of blocks 0..i."""
+
+    def __init__(self, capacity_blocks):
+        self.capacity = max(0, capacity_blocks)
+        self.blocks = OrderedDict()
+
+    def match(self, hashes):
+        """Number of leading blocks already cached (does not touch LRU order)."""
+        n = 0
+        for h in hashes:
+            if h not in self.blocks:
+                break
+            n += 1
+        return n
+
+    def admit(self, hashes):
+        """Marks all blocks as most recently used, inserting missing ones; returns cached count."""
+        hit = self.match(hashes)
+        for h in hashes:
+            if h in self.blocks:
+                self.blocks.move_to_end(h)
+            else:
+                self.blocks[h] = None
+        while len(self.blocks) > self.capacity:
+            self.blocks.popitem(last=False)
+        return hit
+
+class Pod:
+    def __init__(self, i, args):
+        self.name = f"sim-{i}"
+        self.cache = PrefixCache(args.kv_tokens // args.block_size)
+        self.slots = asyncio.Semaphore(args.max_num_seqs)
+        self.running = 0
+        self.waiting = 0
+        self.queries = 0   # prompt tokens looked up in the prefix cache
+        self.hits = 0      # prompt tokens served from it
+        self.requests = 0
+        self.generated = 0
+
+    def load(self):
+        return self.running + self.waiting
+
+def block_hashes(tokens, block_size):
+    """Hashes of the full blocks of a token list (a trailing partial block is never cached)."""
+    out, h = [], 0
+    for start in range(0, len(tokens) - block_size + 1, block_size):
+        h = hash((h, tuple(tokens[start:start + block_size])))
+        out.append(h)
+    return out
+
+def prompt_tokens(messages):
+    tokens = []
+    for m in messages or ():
+        tokens.append(f"<{m.get('role', 'user')}>")
+        content = m.get("content") or ""
+        if isinstance(content, list):  # content parts
+            content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+        tokens.extend(content.split())
+    return tokens
+
+# ---------------- Routing ----------------
+
+class RoundRobin:
+    def __init__(self, pods):
+        self.pods = pods
+        self.next = count()
+
+    def pick(self, hashes):
+        return self.pods[next(self.next) % len(self.pods)]
+
+class Random:
+    def __init__(self, pods, seed=0):
+        self.pods = pods
+        self.rnd = random.Random(seed)
+
+    def pick(self, hashes):
+        return self.rnd.choice(self.pods)
+
+class PrefixAffinity:
+    def __init__(self, pods, max_queue):
+        self.pods = pods
+        self.max_queue = max_queue
+
+    def pick(self, hashes):
+        least = min(self.pods, key=Pod.load)
+        best, best_hit = least, 0
+        for pod in self.pods:
+            hit = pod.cache.match(hashes)
+            if hit > best_hit or (hit == best_hit and hit and pod.load() < best.load()):
+                best, best_hit = pod, hit
+        if best_hit == 0 or best.waiting > self.max_queue:
+            return least
+        return best
+
+# ---------------- Serving ----------------
+
+class Simulator:
+    def __init__(self, args):
+        self.args = args
+        self.pods = [Pod(i, args) for i in range(args.pods)]
+        self.ids = count()
+
+    async def sleep(self, seconds):
+        if seconds > 0 and self.args.time_scale > 0:
+            await asyncio.sleep(seconds * self.args.time_scale)
+
+    async def complete(self, router, req, emit):
+        """
+        Runs one chat completion on the pod picked by router. emit(kind, payload) is awaited
+        with ("first", None) when the first token is ready, ("token", text) per output token
+        and finally ("done", usage).
+        """
+        a = self.args
+        tokens = prompt_tokens(req.get("messages"))
+        hashes = block_hashes(tokens, a.block_size)
+        pod = router.pick(hashes)
+        n_out = max(1, min(int(req.get("max_tokens") or a.max_output_tokens), a.max_output_tokens))
+
+        pod.waiting += 1
+        async with pod.slots:
+            pod.waiting -= 1
+            pod.running += 1
+            try:
+                cached = pod.cache.admit(hashes) * a.block_size
+                pod.queries += len(tokens)
+                pod.hits += cached
+                pod.requests += 1
+                await self.sleep(a.prefill_base_ms / 1000 + a.prefill_ms_per_token / 1000 * (len(tokens) - cached))
+                await emit("first", pod)
+                for i in range(n_out):
+                    if i:
+                        # Decode slows down as more sequences share the pod's batch
+                        contention = 1 + a.decode_contention * (pod.running - 1) / a.max_num_seqs
+                        await self.sleep(a.tpot_ms / 1000 * contention)
+                    pod.generated += 1
+                    await emit("token", " tok" if i else "tok")
+            finally:
+                pod.running -= 1
+        await emit("done", {
+            "prompt_tokens": len(tokens),
+            "completion_tokens": n_out,
+            "total_tokens": len(tokens) + n_out,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        })
+
+    def metrics(self, pods, labelled):
+        model = self.args.model
+        lines = []
+        for name, help_text, kind, value in (
+            ("vllm:num_requests_running", "Requests currently running.", "gauge", lambda p: p.running),
+            ("vllm:num_requests_waiting", "Requests waiting for a slot.", "gauge", lambda p: p.waiting),
+            ("vllm:gpu_cache_usage_perc", "KV cache usage (0-1).", "gauge",
+             lambda p: len(p.cache.blocks) / p.cache.capacity if p.cache.capacity else 0.0),
+            ("vllm:prefix_cache_queries_total", "Prompt tokens looked up in the prefix cache.", "counter",
+             lambda p: p.queries),
+            ("vllm:prefix_cache_hits_total", "Prompt tokens served from the prefix cache.", "counter",
+             lambda p: p.hits),
+            ("vllm:request_success_total", "Finished requests.", "counter", lambda p: p.requests),
+            ("vllm:generation_tokens_total", "Generated tokens.", "counter", lambda p: p.generated),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for p in pods:
+                labels = f'model_name="{model}"' + (f',pod="{p.name}"' if labelled else "")
+                lines.append(f"{name}{{{labels}}} {value(p)}")
+        return "\n".join(lines) + "\n"
+
+# ---------------- HTTP ----------------
+# Minimal HTTP/1.1 on asyncio streams: keep-alive, Content-Length request bodies,
+# chunked responses for SSE. Enough for httpx/requests/curl clients.
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+def response_head(status, headers):
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}"]
+    head += [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(head) + "\r\n\r\n").encode("ascii")
+
+def send_body(writer, status, body, content_type="application/json", extra=None):
+    headers = {"Content-Type": content_type, "Content-Length": str(len(body))}
+    headers.update(extra or {})
+    writer.write(response_head(status, headers) + body)
+
+def chunk(data):
+    return b"%x\r\n%s\r\n" % (len(data), data)
+
+def sse(obj):
+    return chunk(b"data: " + json.dumps(obj, separators=(",", ":")).encode("utf-8") + b"\n\n")
+
+async def chat(sim, router, req, writer):
+    rid = f"chatcmpl-sim-{next(sim.ids)}"
+    model = req.get("model") or sim.args.model
+    created = int(time.time())
+    stream = bool(req.get("stream"))
+    include_usage = stream and bool((req.get("stream_options") or {}).get("include_usage"))
+    text = []
+
+    def frame(delta, finish=None):
+        return {"id": rid, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+
+    async def emit(kind, payload):
+        if kind == "first":
+            if stream:
+                writer.write(response_head(200, {
+                    "Content-Type": "text/event-stream", "Transfer-Encoding": "chunked",
+                    "x-sim-pod": payload.name}))
+                writer.write(sse(frame({"role": "assistant", "content": ""})))
+                await writer.drain()
+            emit.pod = payload
+        elif kind == "token":
+            if stream:
+                writer.write(sse(frame({"content": payload})))
+                await writer.drain()
+            else:
+                text.append(payload)
+        elif stream:
+            writer.write(sse(frame({}, "length")))
+            if include_usage:
+                writer.write(sse({"id": rid, "object": "chat.completion.chunk", "created": created,
+                                  "model": model, "choices": [], "usage": payload}))
+            writer.write(chunk(b"data: [DONE]\n\n") + b"0\r\n\r\n")
+            await writer.drain()
+        else:
+            body = json.dumps({
+                "id": rid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "length",
+                             "message": {"role": "assistant", "content": "".join(text)}}],
+                "usage": payload,
+            }).encode("utf-8")
+            send_body(writer, 200, body, extra={"x-sim-pod": emit.pod.name})
+            await writer.drain()
+
+    await sim.complete(router, req, emit)
+
+async def handle(sim, router, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                k, _, v = line.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+            body = await reader.readexactly(int(headers.get("content-length") or 0))
+            path = path.split("?", 1)[0]
+
+            if path == "/v1/chat/completions":
+                if method != "POST":
+                    send_body(writer, 405, b'{"error":"POST only"}')
+                else:
+                    try:
+                        req = json.loads(body)
+                    except ValueError:
+                        send_body(writer, 400, b'{"error":"invalid JSON"}')
+                    else:
+                        await chat(sim, router, req, writer)
+            elif path == "/v1/models":
+                send_body(writer, 200, json.dumps({"object": "list", "data": [
+                    {"id": sim.args.model, "object": "model", "owned_by": "sim"}]}).encode())
+            elif path == "/health":
+                send_body(writer, 200, b"")
+            elif path == "/metrics":
+                send_body(writer, 200, sim.metrics(sim.pods, True).encode(), "text/plain; version=0.0.4")
+            elif path.startswith("/pods/") and path.endswith("/metrics"):
+                try:
+                    pod = sim.pods[int(path.split("/")[2])]
+                except (ValueError, IndexError):
+                    send_body(writer, 404, b'{"error":"no such pod"}')
+                else:
+                    send_body(writer, 200, sim.metrics([pod], False).encode(), "text/plain; version=0.0.4")
+            else:
+                send_body(writer, 404, b'{"error":"not found"}')
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(args):
+    sim = Simulator(args)
+    lb = RoundRobin(sim.pods) if args.lb_policy == "round-robin" else Random(sim.pods, args.seed)
+    gw = PrefixAffinity(sim.pods, args.affinity_max_queue)
+    servers = []
+    for port, router, label in ((args.lb_port, lb, f"lb ({args.lb_policy})"), (args.gw_port, gw, "gw (prefix-affinity)")):
+        if port:
+            servers.append(await asyncio.start_server(
+                lambda r, w, router=router: handle(sim, router, r, w), args.host, port, backlog=4096))
+            print(f"[sim] {label} on http://{args.host}:{port}", file=sys.stderr)
+    print(f"[sim] {args.pods} pods, {args.kv_tokens} KV tokens each, max_num_seqs={args.max_num_seqs}, "
+          f"time_scale={args.time_scale}", file=sys.stderr)
+    await asyncio.gather(*(s.serve_forever() for s in servers))
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulated multi-pod vLLM backend with LB and gateway routing.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--lb-port", type=int, default=8001, help="Round-robin listener (0 to disable)")
+    ap.add_argument("--gw-port", type=int, default=8002, help="Prefix-affinity listener (0 to disable)")
+    ap.add_argument("--lb-policy", choices=["round-robin", "random"], default="round-robin")
+    ap.add_argument("--pods", type=int, default=2)
+    ap.add_argument("--model", default="Qwen/Qwen3-0.6B", help="Model name reported by the server")
+    ap.add_argument("--kv-tokens", type=int, default=20000, help="Prefix KV cache capacity per pod, in tokens")
+    ap.add_argument("--block-size", type=int, default=16, help="Tokens per cached block (vLLM default 16)")
+    ap.add_argument("--max-num-seqs", type=int, default=64, help="Concurrent sequences per pod")
+    ap.add_argument("--prefill-base-ms", type=float, default=5.0, help="Fixed cost per request")
+    ap.add_argument("--prefill-ms-per-token", type=float, default=0.5, help="Cost per uncached prompt token")
+    ap.add_argument("--tpot-ms", type=float, default=8.0, help="Decode time per output token with one sequence")
+    ap.add_argument("--decode-contention", type=float, default=1.0,
+                    help="Extra decode time per token at a full batch, relative to --tpot-ms")
+    ap.add_argument("--max-output-tokens", type=int, default=64, help="Cap on generated tokens per request")
+    ap.add_argument("--affinity-max-queue", type=int, default=32,
+                    help="gw: ignore prefix affinity when the best pod has more waiting requests")
+    ap.add_argument("--time-scale", type=float, default=1.0,
+                    help="Multiplier on all simulated delays (0 = answer immediately)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    if args.pods < 1 or args.block_size < 1 or args.max_num_seqs < 1:
+        raise SystemExit("--pods, --block-size and --max-num-seqs must be >= 1")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
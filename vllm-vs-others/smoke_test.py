@@ -1,17 +1,263 @@
-import json, httpx, pprint, textwrap
-
-def smoke(url: str):
-    payload = {
-        "model": "llama3",
-        "messages": [{"role": "user", "content": PROMPT}],
-        "max_new_tokens": 32,
-        "stream": False
+#!/usr/bin/env python3
+# smoke_test.py — side-by-side streaming benchmark of vLLM, TGI and Triton serving the same model.
+#
+# Every backend gets the same prompts at the same concurrency levels, one backend at a time.
+# Each level is closed-loop: --concurrency N keeps N requests in flight until --requests have
+# completed. The backends speak different APIs, so each one has an adapter that builds its
+# request (vLLM: /v1/completions "max_tokens", TGI: /generate_stream "max_new_tokens",
+# Triton: /v2/models/<m>/generate_stream "max_tokens") and counts tokens in its SSE stream.
+# All three are given the raw prompt text, so none of them applies a chat template.
+#
+# Examples:
+#   python3 smoke_test.py --vllm-url https://llama3-vllm... --tgi-url https://llama3-default... \
+#       --triton-url https://triton-llama3... --concurrency 1,8,32 --requests 64 --insecure
+#   python3 smoke_test.py --vllm-url $VLLM_URL --tgi-url $TGI_URL --max-tokens 32 --requests 1  # smoke only
+
+import argparse, asyncio, json, math, os, sys, time
+import httpx
+
+DEFAULT_PROMPT = "Explain quantum entanglement in one sentence."
+
+# ---------------- Backend adapters ----------------
+# request(prompt, max_tokens) -> (path, payload); event(obj) -> (tokens_in_event, generated_tokens or None).
+# generated_tokens is the server's own count (usage / details), preferred over counting events.
+
+class OpenAIBackend:
+    kind = "vllm"
+
+    def __init__(self, model):
+        self.model = model
+
+    def request(self, prompt, max_tokens):
+        return "/v1/completions", {
+            "model": self.model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": 0.0,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+    def event(self, obj):
+        usage = obj.get("usage") or {}
+        n = sum(1 for c in obj.get("choices") or () if c.get("text"))
+        return n, usage.get("completion_tokens")
+
+class TGIBackend:
+    kind = "tgi"
+
+    def __init__(self, model):
+        self.model = model
+
+    def request(self, prompt, max_tokens):
+        return "/generate_stream", {
+            "inputs": prompt,
+            "parameters": {"max_new_tokens": max_tokens, "do_sample": False, "details": True},
+        }
+
+    def event(self, obj):
+        token = obj.get("token") or {}
+        n = 1 if token.get("text") and not token.get("special") else 0
+        return n, (obj.get("details") or {}).get("generated_tokens")
+
+class TritonBackend:
+    kind = "triton"
+
+    def __init__(self, model):
+        self.model = model
+
+    def request(self, prompt, max_tokens):
+        return f"/v2/models/{self.model}/generate_stream", {
+            "text_input": prompt,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "parameters": {"temperature": 0.0},
+        }
+
+    def event(self, obj):
+        if "error" in obj:
+            raise RuntimeError(obj["error"])
+        return (1 if obj.get("text_output") else 0), None
+
+BACKENDS = {"vllm": OpenAIBackend, "tgi": TGIBackend, "triton": TritonBackend}
+
+# ---------------- One request ----------------
+
+def percentile(sorted_vals, q):
+    """Nearest-rank percentile of an already sorted list (q in 0..100)."""
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, math.ceil(q * len(sorted_vals) / 100.0) - 1))
+    return sorted_vals[k]
+
+async def stream_once(http, base, backend, prompt, max_tokens):
+    """
+    Sends one streamed request and returns a result dict:
+    ttft_s (send -> first token), full_s, tokens (server count when given, else events with text)
+    and itl_s (gaps between token-carrying events).
+    """
+    path, payload = backend.request(prompt, max_tokens)
+    token_times, counted, reported = [], 0, None
+    t0 = time.perf_counter()
+    async with http.stream("POST", base + path, json=payload) as r:
+        if r.status_code >= 400:
+            await r.aread()
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                obj = json.loads(data)
+            except ValueError:
+                continue
+            n, total = backend.event(obj)
+            if n:
+                token_times.append(time.perf_counter())
+                counted += n
+            if total is not None:
+                reported = total
+    t1 = time.perf_counter()
+    return {
+        "ttft_s": (token_times[0] if token_times else t1) - t0,
+        "full_s": t1 - t0,
+        "tokens": reported if reported is not None else counted,
+        "itl_s": [b - a for a, b in zip(token_times, token_times[1:])],
+    }
+
+# ---------------- One concurrency level ----------------
+
+async def run_level(http, name, base, backend, args, prompts, concurrency):
+    """Closed-loop run of args.requests requests with `concurrency` in flight. Returns the summary row."""
+    results, errors = [], []
+    next_i = 0
+
+    async def user():
+        nonlocal next_i
+        while next_i < args.requests:
+            i = next_i
+            next_i += 1
+            try:
+                results.append(await stream_once(http, base, backend, prompts[i % len(prompts)], args.max_tokens))
+            except Exception as e:
+                errors.append(repr(e))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    ttft = sorted(r["ttft_s"] * 1000 for r in results)
+    itl = sorted(g * 1000 for r in results for g in r["itl_s"])
+    tokens = sum(r["tokens"] for r in results)
+    if errors:
+        print(f"[{name} c={concurrency}] {len(errors)} errors, first: {errors[0]}", file=sys.stderr)
+
+    def ms(v):
+        return round(v, 2) if v is not None else None
+
+    return {
+        "backend": name,
+        "base_url": base,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "req_per_s": round(len(results) / elapsed, 3) if elapsed > 0 else None,
+        "output_tok_per_s": round(tokens / elapsed, 2) if elapsed > 0 else None,
+        "ttft_p50_ms": ms(percentile(ttft, 50)),
+        "ttft_p99_ms": ms(percentile(ttft, 99)),
+        "itl_p50_ms": ms(percentile(itl, 50)),
+        "itl_p99_ms": ms(percentile(itl, 99)),
+        "tokens_per_req": round(tokens / len(results), 1) if results else None,
     }
-    r = httpx.post(f"{url}/v1/chat/completions",
-                   headers=HEADERS, json=payload, timeout=60.0, verify=False)
-    r.raise_for_status()
-    msg = r.json()["choices"][0]["message"]["content"]
-    print(f"\n🟢  {url}\n" + textwrap.fill(msg, 88))
-
-smoke(VLLM_URL)
-smoke(TGI_URL)
+
+# ---------------- Report ----------------
+
+COLUMNS = [
+    ("concurrency", "conc"), ("backend", "backend"), ("req_per_s", "req/s"), ("output_tok_per_s", "tok/s"),
+    ("ttft_p50_ms", "ttft p50"), ("ttft_p99_ms", "ttft p99"), ("itl_p50_ms", "itl p50"),
+    ("itl_p99_ms", "itl p99"), ("tokens_per_req", "tok/req"), ("errors", "err"),
+]
+
+def print_table(rows):
+    cells = [[h for _, h in COLUMNS]] + [["-" if r[k] is None else str(r[k]) for k, _ in COLUMNS] for r in rows]
+    widths = [max(len(c[i]) for c in cells) for i in range(len(COLUMNS))]
+    for j, c in enumerate(cells):
+        print("  ".join(v.rjust(w) for v, w in zip(c, widths)))
+        if j == 0:
+            print("  ".join("-" * w for w in widths))
+
+def read_prompts(path):
+    """One prompt per line; pipe-separated prompts.txt rows contribute their first field."""
+    with open(path, "r", encoding="utf-8") as f:
+        prompts = [line.split("|", 1)[0].strip() for line in f if line.strip()]
+    if not prompts:
+        raise SystemExit(f"No prompts in {path}")
+    return prompts
+
+def parse_levels(spec):
+    try:
+        levels = [int(v) for v in spec.split(",") if v.strip()]
+    except ValueError:
+        raise SystemExit(f"--concurrency must be a comma-separated list of integers, got {spec!r}")
+    if not levels or min(levels) < 1:
+        raise SystemExit("--concurrency levels must be >= 1")
+    return levels
+
+async def main_async(args):
+    targets = [(name, url.rstrip("/")) for name, url in
+               (("vllm", args.vllm_url), ("tgi", args.tgi_url), ("triton", args.triton_url)) if url]
+    if not targets:
+        raise SystemExit("Give at least one of --vllm-url, --tgi-url, --triton-url (or VLLM_URL/TGI_URL/TRITON_URL)")
+    prompts = read_prompts(args.prompts) if args.prompts else [args.prompt]
+    levels = parse_levels(args.concurrency)
+    models = {"vllm": args.model, "tgi": args.model, "triton": args.triton_model}
+
+    headers = {"Content-Type": "application/json"}
+    if args.api_key:
+        headers["Authorization"] = f"Bearer {args.api_key}"
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    rows = []
+    async with httpx.AsyncClient(headers=headers, limits=limits, timeout=args.timeout,
+                                 verify=not args.insecure) as http:
+        for level in levels:
+            for name, base in targets:
+                backend = BACKENDS[name](models[name])
+                for _ in range(max(0, args.warmup)):
+                    try:
+                        await stream_once(http, base, backend, prompts[0], 8)
+                    except Exception as e:
+                        print(f"[warmup {name}] {e}", file=sys.stderr)
+                row = await run_level(http, name, base, backend, args, prompts, level)
+                print(f"[{name} c={level}] {row['req_per_s']} req/s, {row['output_tok_per_s']} tok/s, "
+                      f"ttft p50 {row['ttft_p50_ms']} ms", file=sys.stderr)
+                rows.append(row)
+                if args.jsonl:
+                    with open(args.jsonl, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(row) + "\n")
+    print_table(rows)
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent streaming benchmark: vLLM vs TGI vs Triton")
+    ap.add_argument("--vllm-url", default=os.environ.get("VLLM_URL"), help="vLLM base URL (env VLLM_URL)")
+    ap.add_argument("--tgi-url", default=os.environ.get("TGI_URL"), help="TGI base URL (env TGI_URL)")
+    ap.add_argument("--triton-url", default=os.environ.get("TRITON_URL"), help="Triton base URL (env TRITON_URL)")
+    ap.add_argument("--model", default="meta-llama/Meta-Llama-3-8B-Instruct", help="Model name sent to vLLM/TGI")
+    ap.add_argument("--triton-model", default="llama3", help="Triton model repository name (default llama3)")
+    ap.add_argument("--prompt", default=DEFAULT_PROMPT, help="Prompt used when --prompts is not given")
+    ap.add_argument("--prompts", default=None, help="File with one prompt per line (prompts.txt rows work too)")
+    ap.add_argument("--concurrency", default="1,4,16", help="Comma-separated in-flight levels (default 1,4,16)")
+    ap.add_argument("--requests", type=int, default=32, help="Requests per backend and level (default 32)")
+    ap.add_argument("--max-tokens", type=int, default=128, help="Output token limit for every backend (default 128)")
+    ap.add_argument("--warmup", type=int, default=1, help="Unrecorded requests per backend and level (default 1)")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--api-key", default=os.environ.get("HF_TOKEN"), help="Bearer token (env HF_TOKEN)")
+    ap.add_argument("--insecure", action="store_true", help="Skip TLS verification (self-signed routes)")
+    ap.add_argument("--jsonl", default="", help="Append one summary row per backend and level here")
+    args = ap.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()